@@ -0,0 +1,274 @@
+"""
+In-memory audio capture for speech2picture.
+
+Frames read from the microphone (PyAudio on the RPi, sounddevice on macOS) are
+copied into a preallocated NumPy buffer. The finished recording is handed to the
+transcription step as a file-like WAV object, so nothing is written to the SD card
+unless the user asks for it with -s.
+
+An Endpointer can be given to a recording to end it early once the speaker has
+gone quiet, instead of always recording the full duration.
+
+PreRollRecorder keeps the microphone open on a background thread and remembers the
+last few seconds of audio, so speech that starts just before the button is seen is
+not lost.
+"""
+
+import io
+import threading
+import wave
+
+import numpy as np
+
+SAMPLE_WIDTH = 2        # bytes per sample, all capture is 16 bit
+CHUNK_FRAMES = 1024     # frames read from the device on each call
+
+
+class CapturedAudio:
+    '''mono 16 bit audio held in memory'''
+
+    def __init__(self, samples, sample_rate):
+        self.samples = samples
+        self.sample_rate = sample_rate
+
+    @property
+    def duration(self):
+        '''length of the recording in seconds'''
+        return len(self.samples) / self.sample_rate
+
+    def to_wav_file(self, name="recording.wav"):
+        '''
+        return a file-like object holding the audio as a WAV file
+
+        :param name: file name reported to the transcription API, which uses it to work out the format
+        '''
+        wavFile = io.BytesIO()
+        with wave.open(wavFile, "wb") as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(SAMPLE_WIDTH)
+            wf.setframerate(self.sample_rate)
+            wf.writeframes(self.samples.tobytes())
+        wavFile.seek(0)
+        wavFile.name = name
+        return wavFile
+
+    def save(self, fileName):
+        '''write the audio to disk as a WAV file'''
+        with open(fileName, "wb") as f:
+            f.write(self.to_wav_file().getbuffer())
+
+
+class CaptureBuffer:
+    '''preallocated buffer that chunks of int16 samples are copied into'''
+
+    def __init__(self, maxFrames):
+        self.data = np.zeros(maxFrames, dtype=np.int16)
+        self.length = 0
+
+    def is_full(self):
+        return self.length >= len(self.data)
+
+    def append(self, chunk):
+        '''copy as much of chunk as fits into the buffer'''
+        count = min(len(chunk), len(self.data) - self.length)
+        self.data[self.length:self.length + count] = chunk[:count]
+        self.length += count
+
+    def audio(self, sample_rate):
+        '''return the captured samples as CapturedAudio'''
+        return CapturedAudio(self.data[:self.length].copy(), sample_rate)
+
+
+def frame_rms(samples, frame_len):
+    '''return the RMS level of each complete frame_len frame of int16 samples'''
+    count = len(samples) // frame_len
+    frames = samples[:count * frame_len].astype(np.float32).reshape(count, frame_len)
+    return np.sqrt(np.mean(frames * frames, axis=1))
+
+
+class Endpointer:
+    """
+    Decide when a recording can stop because the speaker has gone quiet.
+
+    Audio is cut into short frames and a frame counts as speech when its RMS level is
+    above both threshold and a multiple of the background noise floor. The noise floor
+    only learns from frames that aren't speech, and is capped at a multiple of threshold,
+    so it can't climb to the level of someone talking. Once speech has been heard,
+    silence_seconds of quiet ends the recording, but never before min_seconds have been
+    recorded after the press; pre-roll audio doesn't count towards it. The maximum
+    length is the recording duration.
+
+    :param sample_rate: sample rate of the audio in Hz
+    :param silence_seconds: trailing quiet that ends the recording
+    :param min_seconds: shortest recording allowed
+    :param threshold: lowest RMS level (int16 scale) that can count as speech
+    """
+
+    FRAME_SECONDS = 0.02
+    NOISE_FACTOR = 3.0
+    MAX_NOISE_FLOOR = 2.0   # times threshold
+
+    def __init__(self, sample_rate, silence_seconds=1.5, min_seconds=2.0, threshold=500):
+        self.frame_len = max(1, int(sample_rate * self.FRAME_SECONDS))
+        self.silence_frames = int(silence_seconds / self.FRAME_SECONDS)
+        self.min_frames = int(min_seconds / self.FRAME_SECONDS)
+        self.threshold = threshold
+        self.noiseFloor = None
+        self.heardSpeech = False
+        self.trailingFrames = 0
+        self.totalFrames = 0
+        self.recordedFrames = 0
+        self._pending = np.zeros(0, dtype=np.int16)
+
+    @property
+    def elapsed(self):
+        '''seconds of audio seen so far'''
+        return self.totalFrames * self.FRAME_SECONDS
+
+    def update(self, chunk, is_preroll=False):
+        '''
+        add a chunk of int16 samples; return True when the recording should stop
+        is_preroll marks audio from before the press, which doesn't count towards min_seconds
+        '''
+        samples = np.concatenate((self._pending, chunk))
+        count = len(samples) // self.frame_len
+        self._pending = samples[count * self.frame_len:]
+        if count == 0:
+            return False
+
+        for rms in frame_rms(samples, self.frame_len):
+            rms = float(rms)
+            if self.noiseFloor is not None and rms > max(self.threshold, self.NOISE_FACTOR * self.noiseFloor):
+                self.heardSpeech = True
+                self.trailingFrames = 0
+            else:
+                # the noise floor follows the quiet frames, dropping at once and rising slowly
+                if self.noiseFloor is None or rms < self.noiseFloor:
+                    self.noiseFloor = min(rms, self.MAX_NOISE_FLOOR * self.threshold)
+                else:
+                    self.noiseFloor = min(0.95 * self.noiseFloor + 0.05 * rms, self.MAX_NOISE_FLOOR * self.threshold)
+                self.trailingFrames += 1
+
+        self.totalFrames += count
+        if not is_preroll:
+            self.recordedFrames += count
+
+        return (self.heardSpeech
+                and self.recordedFrames >= self.min_frames
+                and self.trailingFrames >= self.silence_frames)
+
+
+def record(read_chunk, sample_rate, duration, chunk_frames=CHUNK_FRAMES, endpointer=None):
+    """
+    Record up to duration seconds of audio into memory.
+
+    :param read_chunk: function taking a frame count and returning that many int16 samples
+    :param sample_rate: sample rate of the device in Hz
+    :param duration: maximum seconds of audio to record
+    :param endpointer: optional Endpointer that can end the recording early
+    :return: CapturedAudio
+    """
+    buffer = CaptureBuffer(int(duration * sample_rate))
+    while not buffer.is_full():
+        chunk = read_chunk(chunk_frames)
+        buffer.append(chunk)
+        if endpointer is not None and endpointer.update(chunk):
+            break
+    return buffer.audio(sample_rate)
+
+
+class RingBuffer:
+    '''fixed size ring of int16 samples that always holds the most recent audio'''
+
+    def __init__(self, maxFrames):
+        self.data = np.zeros(maxFrames, dtype=np.int16)
+        self.writeIndex = 0
+        self.filled = 0
+
+    def write(self, chunk):
+        size = len(self.data)
+        if size == 0:
+            return
+        chunk = chunk[-size:]
+        count = len(chunk)
+        first = min(count, size - self.writeIndex)
+        self.data[self.writeIndex:self.writeIndex + first] = chunk[:first]
+        self.data[:count - first] = chunk[first:]
+        self.writeIndex = (self.writeIndex + count) % size
+        self.filled = min(size, self.filled + count)
+
+    def read(self):
+        '''return a copy of the buffered samples, oldest first'''
+        if self.filled < len(self.data):
+            return self.data[:self.filled].copy()
+        return np.concatenate((self.data[self.writeIndex:], self.data[:self.writeIndex]))
+
+
+class PreRollRecorder:
+    """
+    Keep reading the microphone on a background thread so a recording can start
+    with the audio from just before it was requested.
+
+    :param read_chunk: function taking a frame count and returning that many int16 samples
+    :param sample_rate: sample rate of the device in Hz
+    :param preroll_seconds: seconds of audio kept from before record() is called
+    """
+
+    def __init__(self, read_chunk, sample_rate, preroll_seconds, chunk_frames=CHUNK_FRAMES):
+        self.read_chunk = read_chunk
+        self.sample_rate = sample_rate
+        self.chunk_frames = chunk_frames
+        self._ring = RingBuffer(int(preroll_seconds * sample_rate))
+        self._lock = threading.Lock()
+        self._capture = None
+        self._endpointer = None
+        self._captureDone = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="preroll", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout=2):
+        '''stop the background thread; return False if it is still inside a read after timeout seconds'''
+        self._stopping.set()
+        self._thread.join(timeout=timeout)
+        return not self._thread.is_alive()
+
+    def record(self, duration, endpointer=None):
+        '''
+        return the pre-roll followed by up to duration seconds of new audio as CapturedAudio
+        an optional Endpointer can end the recording early
+        '''
+        with self._lock:
+            preroll = self._ring.read()
+            self._captureDone.clear()
+            self._capture = CaptureBuffer(int(duration * self.sample_rate))
+            self._endpointer = endpointer
+            if endpointer is not None:
+                # let the endpointer hear any speech that started before the press
+                endpointer.update(preroll, is_preroll=True)
+
+        # allow a few seconds of slack before deciding the capture thread has died
+        isDone = self._captureDone.wait(timeout=duration + 5)
+
+        with self._lock:
+            capture = self._capture
+            self._capture = None
+            self._endpointer = None
+        if not isDone:
+            raise RuntimeError("audio pre-roll thread stopped delivering audio")
+
+        samples = np.concatenate((preroll, capture.data[:capture.length]))
+        return CapturedAudio(samples, self.sample_rate)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            chunk = self.read_chunk(self.chunk_frames)
+            with self._lock:
+                self._ring.write(chunk)
+                if self._capture is not None and not self._captureDone.is_set():
+                    self._capture.append(chunk)
+                    isEndpoint = self._endpointer is not None and self._endpointer.update(chunk)
+                    if self._capture.is_full() or isEndpoint:
+                        self._captureDone.set()
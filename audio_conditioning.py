@@ -0,0 +1,189 @@
+"""
+Audio conditioning done between capture and transcription.
+
+Whisper works at 16 kHz mono internally, so uploading 44.1 kHz audio, or the
+silence either side of what was said, only costs upload time. condition() trims
+the silence, downmixes and resamples to 16 kHz and encodes the result as WAV,
+FLAC or Ogg. FLAC and Ogg need the soundfile package; without it WAV is used.
+
+Long recordings can be cut at quiet points with split_at_silence() so the pieces
+can be transcribed at the same time.
+"""
+
+import io
+import logging
+import wave
+
+import numpy as np
+
+from audio_capture import CapturedAudio, frame_rms
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+logger = logging.getLogger(__name__)
+
+TARGET_RATE = 16000         # Hz, the rate Whisper works at
+AUDIO_FORMATS = ["raw", "wav", "flac", "ogg"]
+
+
+def load_wav(wavFile):
+    """
+    Read a WAV file into mono 16 bit CapturedAudio.
+
+    :param wavFile: file name or file-like object
+    :return: CapturedAudio
+    """
+    with wave.open(wavFile, "rb") as wf:
+        channels = wf.getnchannels()
+        sampleWidth = wf.getsampwidth()
+        sample_rate = wf.getframerate()
+        raw = wf.readframes(wf.getnframes())
+
+    if sampleWidth == 1:
+        # 8 bit WAV is unsigned
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.int16) - 128) << 8
+    elif sampleWidth == 2:
+        samples = np.frombuffer(raw, dtype=np.int16)
+    elif sampleWidth == 4:
+        samples = (np.frombuffer(raw, dtype=np.int32) >> 16).astype(np.int16)
+    else:
+        raise wave.Error("unsupported sample width: " + str(sampleWidth))
+
+    return CapturedAudio(downmix(samples, channels), sample_rate)
+
+
+def downmix(samples, channels):
+    '''average interleaved int16 samples down to a single channel'''
+    if channels == 1:
+        return samples
+    count = len(samples) // channels
+    frames = samples[:count * channels].reshape(count, channels).astype(np.int32)
+    return frames.mean(axis=1).astype(np.int16)
+
+
+def trim_silence(audio, threshold=300, pad_seconds=0.25):
+    """
+    Remove leading and trailing silence.
+
+    A frame is sound when its RMS level is above threshold and above three times
+    the quietest tenth of the recording. pad_seconds are kept either side of the
+    sound so the start and end of words are not clipped. Audio with no sound in
+    it at all is returned unchanged.
+    """
+    frame_len = max(1, int(audio.sample_rate * 0.02))
+    rms = frame_rms(audio.samples, frame_len)
+    if len(rms) == 0:
+        return audio
+
+    noiseFloor = np.percentile(rms, 10)
+    soundFrames = np.flatnonzero(rms > max(threshold, 3 * noiseFloor))
+    if len(soundFrames) == 0:
+        return audio
+
+    pad = int(pad_seconds * audio.sample_rate)
+    start = max(0, int(soundFrames[0]) * frame_len - pad)
+    end = min(len(audio.samples), (int(soundFrames[-1]) + 1) * frame_len + pad)
+    return CapturedAudio(audio.samples[start:end], audio.sample_rate)
+
+
+def resample(audio, to_rate=TARGET_RATE):
+    """
+    Resample to to_rate Hz.
+
+    When going down in rate a windowed-sinc low pass filter removes everything
+    above the new Nyquist frequency first, then the samples are interpolated onto
+    the new time grid.
+    """
+    if audio.sample_rate == to_rate or len(audio.samples) == 0:
+        return audio
+
+    samples = audio.samples.astype(np.float32)
+    if to_rate < audio.sample_rate:
+        cutoff = 0.9 * (to_rate / 2) / audio.sample_rate     # as a fraction of the input rate
+        taps = np.arange(-50, 51)
+        lowpass = 2 * cutoff * np.sinc(2 * cutoff * taps) * np.hamming(len(taps))
+        lowpass /= lowpass.sum()
+        samples = np.convolve(samples, lowpass, mode="same")
+
+    count = int(len(samples) * to_rate / audio.sample_rate)
+    newTimes = np.arange(count) * (audio.sample_rate / to_rate)
+    resampled = np.interp(newTimes, np.arange(len(samples)), samples)
+    resampled = np.clip(np.round(resampled), -32768, 32767).astype(np.int16)
+    return CapturedAudio(resampled, to_rate)
+
+
+def encode(audio, audio_format="wav"):
+    """
+    Encode audio as a file-like object ready for upload.
+
+    :param audio_format: "wav", "flac" or "ogg"
+    """
+    if audio_format in ("flac", "ogg") and soundfile is None:
+        logger.warning("soundfile is not installed, sending WAV instead of %s", audio_format)
+        audio_format = "wav"
+
+    if audio_format == "wav":
+        return audio.to_wav_file()
+
+    encoded = io.BytesIO()
+    if audio_format == "flac":
+        soundfile.write(encoded, audio.samples, audio.sample_rate, format="FLAC")
+    else:
+        # Opus needs a recent libsndfile, Vorbis works everywhere
+        try:
+            soundfile.write(encoded, audio.samples, audio.sample_rate, format="OGG", subtype="OPUS")
+        except (RuntimeError, TypeError, ValueError):
+            encoded = io.BytesIO()
+            soundfile.write(encoded, audio.samples, audio.sample_rate, format="OGG", subtype="VORBIS")
+    encoded.seek(0)
+    encoded.name = "recording." + audio_format
+    return encoded
+
+
+def split_at_silence(audio, max_seconds=30, overlap_seconds=1.0, search_seconds=5.0):
+    """
+    Split long audio into segments of at most max_seconds for separate transcription.
+
+    Each cut is made at the quietest point in the last search_seconds before the
+    segment would become too long, so cuts land between words where possible.
+    Every segment after the first also starts overlap_seconds before its cut, so a
+    word split by the cut is heard whole by one segment or the other.
+
+    :return: list of CapturedAudio
+    """
+    rate = audio.sample_rate
+    frame_len = max(1, int(rate * 0.02))
+    rms = frame_rms(audio.samples, frame_len)
+    maxLen = int(max_seconds * rate)
+    searchLen = min(int(search_seconds * rate), maxLen // 2)
+    overlap = int(overlap_seconds * rate)
+
+    segments = []
+    start = 0
+    while len(audio.samples) - start > maxLen:
+        # quietest frame in the search window before the segment gets too long
+        windowFirst = (start + maxLen - searchLen) // frame_len
+        windowLast = (start + maxLen) // frame_len
+        cut = (windowFirst + int(np.argmin(rms[windowFirst:windowLast]))) * frame_len
+
+        segmentStart = max(0, start - overlap) if segments else start
+        segments.append(CapturedAudio(audio.samples[segmentStart:cut], rate))
+        start = cut
+
+    segmentStart = max(0, start - overlap) if segments else start
+    segments.append(CapturedAudio(audio.samples[segmentStart:], rate))
+    return segments
+
+
+def condition(audio, audio_format="wav"):
+    """
+    Trim, resample to 16 kHz mono and encode audio for transcription.
+
+    :param audio: CapturedAudio
+    :param audio_format: "wav", "flac" or "ogg"
+    :return: file-like object
+    """
+    return encode(resample(trim_silence(audio)), audio_format)
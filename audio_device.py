@@ -0,0 +1,191 @@
+"""
+Long-lived owner of the microphone.
+
+One AudioDeviceManager is created when the program starts. It initialises the audio
+library once (PyAudio on the RPi, sounddevice on macOS), opens the input stream
+once and then only starts and stops it around each recording, so a button press
+does not pay for driver start up and a kiosk left running for days does not leak
+PortAudio handles. It also keeps timings for how long the device takes to open,
+start and deliver audio.
+"""
+
+import logging
+import time
+
+import numpy as np
+
+from audio_capture import CHUNK_FRAMES
+
+logger = logging.getLogger(__name__)
+
+
+class AudioDeviceManager:
+    """
+    Own the default microphone for 16 bit mono capture.
+
+    :param use_sounddevice: True on macOS, False to use PyAudio (RPi)
+    :param sample_rate: capture rate in Hz, None for the device default on macOS and 44100 on the RPi
+    """
+
+    def __init__(self, use_sounddevice, sample_rate=None, chunk_frames=CHUNK_FRAMES):
+        self.use_sounddevice = use_sounddevice
+        self.sample_rate = sample_rate
+        self.chunk_frames = chunk_frames
+        self.isStarted = False
+        self._pa = None
+        self._stream = None
+        # the errors a broken stream raises, sounddevice adds its own in open()
+        self._streamErrors = (OSError,)
+
+        # latency measurements, all in seconds
+        self.openLatency = None
+        self.startLatency = None
+        self.firstReadLatency = None
+        self.opens = 0
+        self._startTime = None
+        self._readTime = 0.0
+        self._reads = 0
+
+    def open(self):
+        '''initialise the audio library and open the input stream, stopped'''
+        startTime = time.perf_counter()
+
+        if self.use_sounddevice:
+            import sounddevice
+
+            self._streamErrors = (OSError, sounddevice.PortAudioError)
+            # print(sounddevice.query_devices())  # in case you have trouble with the devices
+            if self.sample_rate is None:
+                self.sample_rate = int(sounddevice.query_devices(1)['default_samplerate'])
+            self._stream = sounddevice.InputStream(
+                samplerate=self.sample_rate,
+                channels=1,
+                dtype='int16',
+                blocksize=self.chunk_frames
+                )
+        else:
+            import pyaudio
+
+            if self._pa is None:
+                self._pa = self._create_pyaudio(pyaudio)
+            if self.sample_rate is None:
+                self.sample_rate = 44100
+            self._stream = self._pa.open(
+                format=pyaudio.paInt16,
+                channels=1,
+                rate=self.sample_rate,
+                input=True,
+                frames_per_buffer=self.chunk_frames,
+                start=False
+                ) #,input_device_index=2)
+
+        self.isStarted = False
+        self.opens += 1
+        self.openLatency = time.perf_counter() - startTime
+        logger.info("Audio device opened at %d Hz in %.3f s", self.sample_rate, self.openLatency)
+
+    @staticmethod
+    def _create_pyaudio(pyaudio):
+        '''create the PyAudio instance with the ALSA error chatter silenced'''
+        from ctypes import CFUNCTYPE, c_char_p, c_int, cdll
+
+        # all this crap because the ALSA library can't police itself
+        ERROR_HANDLER_FUNC = CFUNCTYPE(None, c_char_p, c_int, c_char_p, c_int, c_char_p)
+        def py_error_handler(filename, line, function, err, fmt):
+            pass #nothing to see here
+        c_error_handler = ERROR_HANDLER_FUNC(py_error_handler)
+        asound = cdll.LoadLibrary('libasound.so')
+        # Set error handler
+        asound.snd_lib_error_set_handler(c_error_handler)
+        # Initialize PyAudio
+        pa = pyaudio.PyAudio()
+        # Reset to default error handler
+        asound.snd_lib_error_set_handler(None)
+        # now on with the show, sheesh
+        return pa
+
+    def start(self):
+        '''start delivering audio'''
+        if self._stream is None:
+            self.open()
+        if self.isStarted:
+            return
+        startTime = time.perf_counter()
+        if self.use_sounddevice:
+            self._stream.start()
+        else:
+            self._stream.start_stream()
+        self.isStarted = True
+        self.startLatency = time.perf_counter() - startTime
+        self._startTime = startTime
+        self.firstReadLatency = None
+
+    def stop(self):
+        '''stop delivering audio, the stream stays open for the next recording'''
+        if self._stream is None or not self.isStarted:
+            return
+        if self.use_sounddevice:
+            self._stream.stop()
+        else:
+            self._stream.stop_stream()
+        self.isStarted = False
+
+    def read_chunk(self, frames):
+        '''return the next frames int16 samples from the microphone'''
+        startTime = time.perf_counter()
+        try:
+            samples = self._read(frames)
+        except self._streamErrors as e:
+            # the device went away or the stream broke, open it again and carry on
+            logger.warning("Audio read failed, reopening the device: %s", e)
+            self.reopen()
+            samples = self._read(frames)
+
+        now = time.perf_counter()
+        if self.firstReadLatency is None and self._startTime is not None:
+            self.firstReadLatency = now - self._startTime
+        self._readTime += now - startTime
+        self._reads += 1
+        return samples
+
+    def _read(self, frames):
+        if self.use_sounddevice:
+            data, overflowed = self._stream.read(frames)
+            return data[:, 0]
+        data = self._stream.read(frames, exception_on_overflow=False)
+        return np.frombuffer(data, dtype=np.int16)
+
+    def reopen(self):
+        '''close the stream and open a new one, restarting it if it was running'''
+        wasStarted = self.isStarted
+        self._close_stream()
+        self.open()
+        if wasStarted:
+            self.start()
+
+    def _close_stream(self):
+        if self._stream is None:
+            return
+        try:
+            self.stop()
+            self._stream.close()
+        except self._streamErrors as e:
+            logger.warning("Error closing audio stream: %s", e)
+        self._stream = None
+        self.isStarted = False
+
+    def close(self):
+        '''close the stream and release the audio library'''
+        self._close_stream()
+        if self._pa is not None:
+            self._pa.terminate()
+            self._pa = None
+
+    def latency_report(self):
+        '''one line summary of the device timings'''
+        def ms(seconds):
+            return "-" if seconds is None else "%.0f ms" % (seconds * 1000)
+        averageRead = self._readTime / self._reads if self._reads else None
+        return ("open " + ms(self.openLatency) + " (opened " + str(self.opens) + "x), start "
+                + ms(self.startLatency) + ", first audio " + ms(self.firstReadLatency)
+                + ", average read " + ms(averageRead))
@@ -0,0 +1,134 @@
+"""
+Find the past picture whose caption best matches some keywords.
+
+When a new picture can't be made, a picture made before for similar words is
+the next best thing. Each picture's caption is kept as a row of word counts in
+a NumPy matrix, and a search weights the counts by TF-IDF and takes the cosine
+similarity of every row with the keywords in one matrix product.
+
+Captions are appended to a text file as pictures are made, one JSON line each,
+so adding one never rewrites the file and loading is just reading it back.
+The matrix doubles in size when it fills up, so adding a row rarely copies it.
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+import keyword_extract
+
+INITIAL_ROWS = 64
+INITIAL_WORDS = 256
+
+
+def words(text):
+    '''the words of text worth matching on, without stopwords or punctuation'''
+    return [word for phrase in keyword_extract.candidate_phrases(text) for word in phrase]
+
+
+class FallbackIndex:
+    """
+    TF-IDF index of picture captions.
+
+    :param path: the file captions are kept in, created if need be
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self._names = []
+        self._rows = {}         # name -> row, a picture added again replaces its row
+        self._vocabulary = {}   # word -> column
+        self._counts = np.zeros((INITIAL_ROWS, INITIAL_WORDS), dtype=np.float32)
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue    # a line cut short when the program was stopped
+                    self._insert(entry["name"], entry["text"])
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._rows
+
+    def add(self, name, text):
+        '''index the caption text of the picture called name, and save it'''
+        with self._lock:
+            self._insert(name, text)
+            with open(self.path, "a") as f:
+                f.write(json.dumps({"name": name, "text": text}) + "\n")
+
+    def _insert(self, name, text):
+        # called with the lock held, or from __init__
+        columns = [self._column(word) for word in words(text)]
+
+        row = self._rows.get(name)
+        if row is None:
+            row = len(self._names)
+            if row == self._counts.shape[0]:
+                self._grow(rows=row * 2)
+            self._names.append(name)
+            self._rows[name] = row
+
+        self._counts[row] = 0
+        np.add.at(self._counts[row], columns, 1)
+
+    def _column(self, word):
+        column = self._vocabulary.get(word)
+        if column is None:
+            column = len(self._vocabulary)
+            if column == self._counts.shape[1]:
+                self._grow(columns=column * 2)
+            self._vocabulary[word] = column
+        return column
+
+    def _grow(self, rows=None, columns=None):
+        rows = rows or self._counts.shape[0]
+        columns = columns or self._counts.shape[1]
+        counts = np.zeros((rows, columns), dtype=np.float32)
+        counts[:self._counts.shape[0], :self._counts.shape[1]] = self._counts
+        self._counts = counts
+
+    def search(self, text, allowed=None):
+        """
+        Return (name, similarity) of the picture whose caption best matches text, or None.
+
+        :param allowed: optional set of names to choose from, the others are ignored
+        """
+        with self._lock:
+            columns = [self._vocabulary[word] for word in words(text) if word in self._vocabulary]
+            if not columns or not self._names:
+                return None
+
+            counts = self._counts[:len(self._names), :len(self._vocabulary)]
+            documentFrequency = np.count_nonzero(counts, axis=0)
+            idf = np.log((1 + len(self._names)) / (1 + documentFrequency)) + 1
+
+            weights = counts * idf
+            norms = np.linalg.norm(weights, axis=1)
+            norms[norms == 0] = 1
+
+            query = np.zeros(len(self._vocabulary), dtype=np.float32)
+            np.add.at(query, columns, 1)
+            query *= idf
+
+            similarity = (weights @ query) / norms / np.linalg.norm(query)
+            if allowed is not None:
+                isAllowed = np.array([name in allowed for name in self._names])
+                similarity[~isAllowed] = 0
+
+            best = int(np.argmax(similarity))
+            if similarity[best] <= 0:
+                return None
+            return self._names[best], float(similarity[best])
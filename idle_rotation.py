@@ -0,0 +1,163 @@
+"""
+Ready-to-show pictures for the idle display.
+
+The idle display shows a new picture every few seconds. Opening, decoding and
+resizing a picture from the SD card takes long enough to be seen, so
+IdleRotation picks the next picture ahead of time and prepares it on a
+background thread. Prepared pictures are kept, already resized, keyed by the
+picture and the window size, up to a limit on the memory they use.
+
+The pictures are dealt like a deck of cards, so each one comes round again
+only after all the others. Least recently used eviction would always drop the
+picture that is needed soonest, and when the folder holds more than fit, it
+would never hit. So once the limit is reached, nothing more is kept and the
+pictures already kept stay: those hit on every pass, and the rest are
+prepared each time they come up. The prefetch hides that either way.
+
+Tk isn't used here: the caller turns a Rendition into a PhotoImage on the Tk
+thread, which is all that is left to do when it is time to show it.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import latency
+
+logger = logging.getLogger(__name__)
+
+RESIZE_FACTOR = 0.95    # share of the window height the picture fills
+QR_FACTOR = 0.15        # share of the picture's shorter side the QR code fills
+
+
+class Rendition:
+    '''a picture, and its QR code if it has one, resized for one window size'''
+
+    def __init__(self, path, image, qr):
+        self.path = path
+        self.image = image
+        self.qr = qr
+        self.size = sum(len(picture.getbands()) * picture.width * picture.height
+                        for picture in (image, qr) if picture is not None)
+
+
+def prepare(path, window_size, with_qr=False):
+    '''open the picture at path and its QR code, resized to fit a window of window_size, and return a Rendition'''
+    startTime = time.time()
+    image = Image.open(path)
+    height = int(window_size[1] * RESIZE_FACTOR)
+    width = int(height * image.width / image.height)
+    image = image.resize((width, height), Image.NEAREST)
+
+    qr = None
+    qrPath = path.replace("-image.png", "-s3_url.jpg")
+    if with_qr and os.path.exists(qrPath):
+        qrSize = int(QR_FACTOR * min(width, height))
+        qr = Image.open(qrPath).resize((qrSize, qrSize), Image.NEAREST)
+
+    latency.tracker("idle prepare").record(time.time() - startTime)
+    return Rendition(path, image, qr)
+
+
+class IdleRotation:
+    """
+    Pick the pictures for the idle display and prepare them ahead of time.
+
+    :param folder: the folder of pictures, *.png
+    :param max_bytes: most memory the prepared pictures may use
+    :param with_qr: if true, also prepare each picture's QR code
+    """
+
+    def __init__(self, folder, max_bytes, with_qr=False):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.with_qr = with_qr
+        self.hits = 0
+        self.misses = 0
+        self._deck = []
+        self._lastPath = None
+        self._renditions = {}               # (path, window size) -> Rendition
+        self._size = 0
+        self._pending = None                # (window size, future) of the next picture
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="idle")
+
+    def _next_path(self):
+        # deal the pictures in a random order, listing the folder again once they have all been shown
+        if not self._deck:
+            self._deck = [os.path.join(self.folder, file) for file in os.listdir(self.folder) if file.endswith(".png")]
+            random.shuffle(self._deck)
+            self._forget(lambda key: key[0] not in self._deck)
+            if len(self._deck) > 1 and self._deck[-1] == self._lastPath:
+                # don't show the same picture twice in a row
+                self._deck[0], self._deck[-1] = self._deck[-1], self._deck[0]
+        if not self._deck:
+            return None
+        self._lastPath = self._deck.pop()
+        return self._lastPath
+
+    def _forget(self, isStale):
+        # drop the renditions whose key isStale, for pictures that have gone or an old window size
+        with self._lock:
+            for key in [key for key in self._renditions if isStale(key)]:
+                self._size -= self._renditions.pop(key).size
+
+    def _rendition(self, path, window_size):
+        # on the background thread: from the cache if it's there, otherwise prepared and kept if there is room
+        key = (path, window_size)
+        with self._lock:
+            rendition = self._renditions.get(key)
+            if rendition is not None:
+                self.hits += 1
+                return rendition
+            self.misses += 1
+
+        # after a resize the renditions for the old size won't be shown again
+        self._forget(lambda key: key[1] != window_size)
+        rendition = prepare(path, window_size, self.with_qr)
+
+        with self._lock:
+            if self._size + rendition.size <= self.max_bytes:
+                self._renditions[key] = rendition
+                self._size += rendition.size
+        return rendition
+
+    def prefetch(self, window_size):
+        '''choose the next picture and start preparing it for a window of window_size'''
+        path = self._next_path()
+        if path is None:
+            self._pending = None
+            return
+        self._pending = (window_size, self._executor.submit(self._rendition, path, window_size))
+
+    def take(self, window_size):
+        '''
+        return the Rendition prefetched for window_size, or None if it isn't ready
+        or was prepared for a different window size
+        '''
+        if self._pending is None:
+            return None
+        pendingSize, future = self._pending
+        if pendingSize != window_size or not future.done():
+            return None
+        self._pending = None
+        try:
+            return future.result()
+        except Exception as e:
+            logger.warning("Couldn't prepare idle picture: %s", e)
+            return None
+
+    def stats(self):
+        '''short text description of the cache'''
+        with self._lock:
+            msg = "%d ready, %.1f MB of %.0f MB, %d hits, %d misses" % (
+                len(self._renditions), self._size / (1024*1024), self.max_bytes / (1024*1024), self.hits, self.misses)
+        return msg
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
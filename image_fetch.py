@@ -0,0 +1,86 @@
+"""
+Download generated images concurrently and decode them in memory.
+
+All downloads share one pooled HTTP session, run at the same time on a small
+thread pool, and are decoded straight from the response bytes, so nothing is
+written to disk until the finished composite is saved.
+
+Images the API returned inline as base64 (response_format="b64_json") are just
+decoded, with no download at all.
+"""
+
+import base64
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import httpx
+from PIL import Image
+
+DOWNLOAD_TIMEOUT = httpx.Timeout(connect=5.0, read=30.0, write=10.0, pool=5.0)
+
+_session = None
+_sessionLock = threading.Lock()
+
+
+def session():
+    '''the shared HTTP session, created on first use'''
+    global _session
+    with _sessionLock:
+        if _session is None:
+            _session = httpx.Client(
+                limits=httpx.Limits(max_connections=8, max_keepalive_connections=8, keepalive_expiry=120),
+                timeout=DOWNLOAD_TIMEOUT,
+                follow_redirects=True,
+                )
+        return _session
+
+
+def fetch_image(url):
+    '''download the image at url and return it as a PIL Image'''
+    response = session().get(url)
+    response.raise_for_status()
+    image = Image.open(io.BytesIO(response.content))
+    image.load()    # decode now, on this thread
+    return image
+
+
+def decode_b64_image(b64):
+    '''decode a base64 encoded image and return it as a PIL Image'''
+    image = Image.open(io.BytesIO(base64.b64decode(b64)))
+    image.load()
+    return image
+
+
+def load_image(item):
+    """
+    Return a PIL Image for one generated image.
+
+    :param item: a URL, or an item of an images.generate response with b64_json or url set
+    """
+    if isinstance(item, str):
+        return fetch_image(item)
+    if getattr(item, "b64_json", None):
+        return decode_b64_image(item.b64_json)
+    return fetch_image(item.url)
+
+
+def fetch_images_as_completed(items, max_workers=4):
+    """
+    Load images concurrently, yielding (index, image) as each one is decoded.
+
+    :param items: URLs or images.generate response items, see load_image()
+    An error loading any image is raised when its turn comes.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="download") as executor:
+        futures = {executor.submit(load_image, item): index for index, item in enumerate(items)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def fetch_images(items, max_workers=4):
+    '''load images concurrently and return them in the same order as items'''
+    images = [None] * len(items)
+    for index, image in fetch_images_as_completed(items, max_workers):
+        images[index] = image
+    return images
@@ -0,0 +1,101 @@
+"""
+Local keyword extraction for image prompts.
+
+A RAKE style extractor: the transcript is split into candidate phrases at stopwords
+and punctuation, every word is scored by how often it appears and how many words
+it keeps company with, and the best scoring phrases are joined into a short noun
+phrase list. It runs in well under a millisecond, so it can stand in for the LLM
+abstraction call on medium length transcripts or when that call is too slow.
+"""
+
+import re
+
+# common English words that never start or end a key phrase, plus filler that shows up in speech
+STOPWORDS = frozenset("""
+a about above after again against all almost also am an and any are aren't around as at
+be because been before being below between both but by can can't cannot could couldn't
+did didn't do does doesn't doing don't down during each either else even ever every few
+for from further get gets getting go goes going gonna got gotta had hadn't has hasn't have
+haven't having he he'd he'll he's her here here's hers herself him himself his how how's
+i i'd i'll i'm i've if in into is isn't it it's its itself just kind kinda know let let's
+like lot lots make makes may maybe me might more most much must mustn't my myself need no
+nor not now of off oh ok okay on once one only or other ought our ours ourselves out over
+own pretty probably quite rather really right said same say says see shall shan't she
+she'd she'll she's should shouldn't so some something sort stuff such sure than that
+that's the their theirs them themselves then there there's these they they'd they'll
+they're they've thing things think this those though through to too um uh under until up
+upon us very want wanna was wasn't way we we'd we'll we're we've well were weren't what
+what's when when's where where's whether which while who who's whom why why's will with
+won't would wouldn't yeah yes yet you you'd you'll you're you've your yours yourself
+yourselves
+""".split())
+
+_SPLIT_PATTERN = re.compile(r"[^\w\s'-]+")
+_WORD_PATTERN = re.compile(r"[\w'-]+")
+
+
+def candidate_phrases(text):
+    '''split text into runs of words that contain no stopwords or punctuation'''
+    phrases = []
+    for fragment in _SPLIT_PATTERN.split(text.lower()):
+        phrase = []
+        for word in _WORD_PATTERN.findall(fragment):
+            word = word.strip("'-")
+            if not word or word in STOPWORDS or word.isdigit():
+                if phrase:
+                    phrases.append(phrase)
+                phrase = []
+            else:
+                phrase.append(word)
+        if phrase:
+            phrases.append(phrase)
+    return phrases
+
+
+def score_phrases(phrases):
+    """
+    Score each distinct phrase as the sum of its word scores.
+
+    A word scores its degree (the total length of the phrases it appears in) over
+    its frequency, which favours words that appear in longer phrases.
+    """
+    frequency = {}
+    degree = {}
+    for phrase in phrases:
+        for word in phrase:
+            frequency[word] = frequency.get(word, 0) + 1
+            degree[word] = degree.get(word, 0) + len(phrase)
+
+    scores = {}
+    for phrase in phrases:
+        key = " ".join(phrase)
+        if key not in scores:
+            scores[key] = sum(degree[word] / frequency[word] for word in phrase)
+    return scores
+
+
+def extract_keywords(text, max_words=15):
+    """
+    Return the highest scoring key phrases of text, joined with commas.
+
+    Phrases are taken best first until max_words words have been used, then put
+    back in the order they were spoken so the result reads naturally.
+    """
+    phrases = candidate_phrases(text)
+    scores = score_phrases(phrases)
+
+    chosen = []
+    wordCount = 0
+    for phrase in sorted(scores, key=scores.get, reverse=True):
+        length = len(phrase.split())
+        if wordCount + length > max_words:
+            continue
+        chosen.append(phrase)
+        wordCount += length
+
+    firstSeen = {}
+    for position, phrase in enumerate(phrases):
+        firstSeen.setdefault(" ".join(phrase), position)
+    chosen.sort(key=firstSeen.get)
+
+    return ", ".join(chosen)
@@ -0,0 +1,142 @@
+"""
+In-process latency tracking and hedged requests.
+
+tracker(name) returns the LatencyTracker for one kind of call, which remembers
+the most recent latencies so percentiles can be taken from real calls.
+hedged_call() uses those percentiles: when a call has taken longer than, say,
+the 90th percentile of recent calls, a duplicate is started and whichever
+finishes first is used. A HedgeBudget caps how many duplicates may be started
+in an hour, so the extra cost stays bounded.
+"""
+
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+MIN_SAMPLES = 5     # latencies needed before percentiles are trusted
+
+
+class LatencyTracker:
+    '''the most recent latencies of one kind of call'''
+
+    def __init__(self, size=100):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def count(self):
+        with self._lock:
+            return len(self._samples)
+
+    def percentile(self, p):
+        '''the p-th percentile of the recent latencies, None until there are MIN_SAMPLES of them'''
+        with self._lock:
+            if len(self._samples) < MIN_SAMPLES:
+                return None
+            samples = sorted(self._samples)
+        # linear interpolation between the closest ranks
+        rank = (len(samples) - 1) * p / 100
+        lower = int(rank)
+        upper = min(lower + 1, len(samples) - 1)
+        return samples[lower] + (samples[upper] - samples[lower]) * (rank - lower)
+
+    def summary(self):
+        '''short text description of the recent latencies'''
+        p50 = self.percentile(50)
+        if p50 is None:
+            return "%d samples" % self.count()
+        return "p50 %.1f s, p90 %.1f s, %d samples" % (p50, self.percentile(90), self.count())
+
+
+_trackers = {}
+_trackersLock = threading.Lock()
+
+
+def tracker(name):
+    '''the LatencyTracker for name, created on first use'''
+    with _trackersLock:
+        if name not in _trackers:
+            _trackers[name] = LatencyTracker()
+        return _trackers[name]
+
+
+class HedgeBudget:
+    '''allow at most per_hour hedged requests in any rolling hour'''
+
+    def __init__(self, per_hour):
+        self.per_hour = per_hour
+        self._spent = deque()
+        self._lock = threading.Lock()
+
+    def try_spend(self):
+        '''use one hedge from the budget; return False if the budget is used up'''
+        now = time.time()
+        with self._lock:
+            while self._spent and now - self._spent[0] > 3600:
+                self._spent.popleft()
+            if len(self._spent) >= self.per_hour:
+                return False
+            self._spent.append(now)
+            return True
+
+
+def hedged_call(function, hedge_after, budget=None):
+    """
+    Call function(), starting a duplicate call if the first is slow.
+
+    :param function: the call to make; it may be run twice at once
+    :param hedge_after: seconds to wait before starting the duplicate, None never to
+    :param budget: optional HedgeBudget that must allow the duplicate
+    :return: the result of whichever call succeeds first; if both fail, the first error is raised
+    """
+    results = queue.Queue()
+
+    def run(attempt):
+        try:
+            results.put((attempt, True, function()))
+        except Exception as e:
+            results.put((attempt, False, e))
+
+    def start(attempt):
+        # daemon threads, so the call that loses doesn't hold up anything
+        threading.Thread(target=run, args=(attempt,), name="hedge%d" % attempt, daemon=True).start()
+
+    startTime = time.time()
+    start(0)
+    running = 1
+    isHedgeDecided = hedge_after is None
+    isHedged = False
+    firstError = None
+
+    while running > 0:
+        timeout = None if isHedgeDecided else max(0, hedge_after - (time.time() - startTime))
+        try:
+            attempt, isOk, value = results.get(timeout=timeout)
+        except queue.Empty:
+            # the first call is slow, decide once whether to start a duplicate
+            isHedgeDecided = True
+            if budget is None or budget.try_spend():
+                logger.info("Call still running after %.1f s, starting a hedged request", hedge_after)
+                start(1)
+                running += 1
+                isHedged = True
+            else:
+                logger.info("Hedge budget used up, not hedging")
+            continue
+
+        running -= 1
+        if isOk:
+            if isHedged:
+                logger.info("Hedged call won by request %d after %.1f s", attempt, time.time() - startTime)
+            return value
+        if firstError is None:
+            firstError = value
+
+    raise firstError
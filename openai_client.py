@@ -0,0 +1,106 @@
+"""
+One configured OpenAI client for the whole program.
+
+The client keeps its HTTPS connections alive in a pool, so the transcription,
+chat and image calls made for each button press reuse the same TLS connection.
+Each kind of call gets its own connect and read timeouts, so a hung call can't
+stall the kiosk, and transient failures are retried a few times with jittered
+exponential back off. classify_error() turns the exceptions the openai package
+raises into an ErrorKind the rest of the program can act on.
+"""
+
+import logging
+import random
+import time
+from enum import Enum
+
+import httpx
+import openai
+
+logger = logging.getLogger(__name__)
+
+# per endpoint timeouts, in seconds
+TIMEOUTS = {
+    "transcribe": httpx.Timeout(connect=5.0, read=60.0, write=60.0, pool=5.0),
+    "chat":       httpx.Timeout(connect=5.0, read=30.0, write=10.0, pool=5.0),
+    "image":      httpx.Timeout(connect=5.0, read=120.0, write=10.0, pool=5.0),
+}
+
+# attempts per endpoint, including the first one
+ATTEMPTS = {
+    "transcribe": 3,
+    "chat": 3,
+    "image": 2,
+}
+
+RETRY_BASE_DELAY = 0.5      # seconds, doubled on each retry
+RETRY_MAX_DELAY = 8.0
+
+
+class ErrorKind(Enum):
+    CONTENT_POLICY = "content policy violation"
+    RATE_LIMIT = "rate limited"
+    TIMEOUT = "timed out"
+    CONNECTION = "connection error"
+    SERVER = "server error"
+    OTHER = "other error"
+
+
+# kinds of error that may well go away if the call is made again
+TRANSIENT_ERRORS = {ErrorKind.RATE_LIMIT, ErrorKind.TIMEOUT, ErrorKind.CONNECTION, ErrorKind.SERVER}
+
+
+def create_client():
+    """
+    Create the OpenAI client with a keep-alive connection pool.
+
+    The API key is read from the OPENAI_API_KEY environment variable. Retries are
+    done by call_with_retries(), so the client's own are turned off.
+    """
+    httpClient = httpx.Client(
+        limits=httpx.Limits(max_connections=10, max_keepalive_connections=10, keepalive_expiry=120),
+        timeout=TIMEOUTS["chat"],
+        )
+    return openai.OpenAI(http_client=httpClient, max_retries=0)
+
+
+def for_endpoint(client, endpoint):
+    '''return a copy of client with the timeouts for endpoint; it shares the connection pool'''
+    return client.with_options(timeout=TIMEOUTS[endpoint])
+
+
+def classify_error(e):
+    '''return the ErrorKind of an exception raised by the openai package'''
+    if isinstance(e, openai.BadRequestError) and getattr(e, "code", None) == "content_policy_violation":
+        return ErrorKind.CONTENT_POLICY
+    if isinstance(e, openai.RateLimitError):
+        return ErrorKind.RATE_LIMIT
+    if isinstance(e, (openai.APITimeoutError, TimeoutError)):
+        return ErrorKind.TIMEOUT
+    if isinstance(e, openai.APIConnectionError):
+        return ErrorKind.CONNECTION
+    if isinstance(e, openai.InternalServerError):
+        return ErrorKind.SERVER
+    return ErrorKind.OTHER
+
+
+def call_with_retries(endpoint, function, *args, **kwargs):
+    """
+    Call function(*args, **kwargs), retrying transient errors.
+
+    :param endpoint: "transcribe", "chat" or "image", picks how many attempts are made
+    :return: whatever function returns; the last error is raised when attempts run out
+    """
+    attempts = ATTEMPTS[endpoint]
+    for attempt in range(attempts):
+        try:
+            return function(*args, **kwargs)
+        except Exception as e:
+            kind = classify_error(e)
+            if kind not in TRANSIENT_ERRORS or attempt == attempts - 1:
+                raise
+            # full jitter, so several frames retrying at once don't all come back together
+            delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+            logger.warning("%s call failed (%s), retry %d of %d in %.1f s: %s",
+                           endpoint, kind.value, attempt + 1, attempts - 1, delay, e)
+            time.sleep(delay)
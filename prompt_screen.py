@@ -0,0 +1,148 @@
+"""
+Screen image prompts locally before they are sent to the image API.
+
+A prompt the API turns down for its content policy costs a full round trip, so
+the terms that usually cause that are looked for here first. The terms are
+read from a text file and compiled into an Aho-Corasick automaton, which finds
+every term in one pass over the prompt however many terms there are.
+
+The term file has one term per line. A line "term => replacement" rewrites the
+term, any other line rejects the whole prompt. Blank lines and lines starting
+with # are ignored. Matching ignores case and only matches whole words.
+"""
+
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class PromptRejected(Exception):
+    '''raised for a prompt that contains a rejected term'''
+
+    def __init__(self, term):
+        super().__init__("prompt contains a blocked term: " + term)
+        self.term = term
+
+
+class AhoCorasick:
+    '''find every occurrence of a fixed set of terms in a text in one pass'''
+
+    def __init__(self, terms):
+        self._goto = [{}]       # node -> {character: node}
+        self._fail = [0]
+        self._output = [[]]     # node -> terms that end here
+        for term in terms:
+            self._add(term)
+        self._link()
+
+    def _add(self, term):
+        node = 0
+        for character in term:
+            nextNode = self._goto[node].get(character)
+            if nextNode is None:
+                nextNode = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[node][character] = nextNode
+            node = nextNode
+        self._output[node].append(term)
+
+    def _link(self):
+        # breadth first, so a node's fail link is set before its children need it
+        pending = deque(self._goto[0].values())
+        while pending:
+            node = pending.popleft()
+            for character, child in self._goto[node].items():
+                pending.append(child)
+                fail = self._fail[node]
+                while fail and character not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(character, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def find(self, text):
+        '''yield (start, end, term) for every occurrence of a term in text'''
+        node = 0
+        for position, character in enumerate(text):
+            while node and character not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(character, 0)
+            for term in self._output[node]:
+                yield position + 1 - len(term), position + 1, term
+
+
+def _is_word_boundary(text, position):
+    return position <= 0 or position >= len(text) or not text[position].isalnum() or not text[position - 1].isalnum()
+
+
+class PromptScreen:
+    """
+    Reject or rewrite prompts that contain terms from a term file.
+
+    :param path: the term file, see the module description
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.rejections = 0
+        self.rewrites = 0
+        self._rejected = set()
+        self._replacements = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                if "=>" in line:
+                    term, replacement = line.split("=>", 1)
+                    term = term.strip().lower()
+                    if not term:
+                        # an empty term would match everywhere
+                        logger.warning("Ignoring prompt screen line with no term: %s", line)
+                        continue
+                    self._replacements[term] = replacement.strip()
+                else:
+                    self._rejected.add(line.lower())
+        self._matcher = AhoCorasick(self._rejected | set(self._replacements))
+
+    def __len__(self):
+        return len(self._rejected) + len(self._replacements)
+
+    def screen(self, prompt):
+        """
+        Return prompt with any terms to rewrite replaced.
+
+        Raises PromptRejected if it contains a term to reject.
+        """
+        lowered = prompt.lower()
+        matches = [(start, end, term) for start, end, term in self._matcher.find(lowered)
+                   if _is_word_boundary(lowered, start) and _is_word_boundary(lowered, end)]
+
+        for start, end, term in matches:
+            if term in self._rejected:
+                self.rejections += 1
+                raise PromptRejected(term)
+
+        if not matches:
+            return prompt
+
+        # replace the longest of any overlapping matches, working left to right
+        matches.sort(key=lambda match: (match[0], -match[1]))
+        pieces = []
+        position = 0
+        for start, end, term in matches:
+            if start < position:
+                continue
+            pieces.append(prompt[position:start])
+            pieces.append(self._replacements[term])
+            position = end
+        pieces.append(prompt[position:])
+
+        self.rewrites += 1
+        return "".join(pieces)
+
+    def stats(self):
+        '''short text description of the screen'''
+        return "%d terms, %d rejected, %d rewritten" % (len(self), self.rejections, self.rewrites)
@@ -116,9 +116,12 @@ Specific to Raspberry Pi:
         pip install openai 
         pip install pillow
         pip install pyaudio
+        pip install numpy       audio is captured into numpy buffers in memory
+        pip install soundfile   optional, needed only for --audio_format flac or ogg
         pip install RPi.GPIO
         pip install boto3       needed only if you are going to use teh -q option to store finished images in the AWS S3 cloud
         pip install qrcode      needed if you are using the -q option and S3 to enable instant downloads via QR code
+        pip install faster-whisper  needed only for --stt local, to turn speech into text on this computer
 
     Note that when run you will see 10 or so lines of errors about sockets and JACKD and whatnot.
     Don't worry, it is still working. If you know how to fix this, please let me know.
@@ -149,23 +152,40 @@ import platform
 import argparse
 import logging
 from logging.handlers import TimedRotatingFileHandler
-import urllib.request
 import time
 import datetime
 import shutil
 import re
 import os
-import select
 import sys
 import random
 import tkinter as tk
 import json
 import string
+import io
+import wave
+import atexit
+import threading
+import queue
+import functools
+import collections
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
 from enum import IntEnum
 from PIL import Image, ImageDraw, ImageFont, ImageTk
 from s3_and_qr import upload_to_s3_and_generate_qr
-
-import openai
+import audio_capture
+import audio_device
+import audio_conditioning
+import speech_to_text
+import keyword_extract
+import image_fetch
+import latency
+import s2p_cache
+import fallback_index
+import prompt_screen
+import idle_rotation
+
+import openai_client
 S2P_VERSION = "1.2"
 
 g_isMacOS = False
@@ -175,23 +195,19 @@ else:
     print ("Not MacOS")
 
 # import platform specific libraries
-if g_isMacOS:
-    import sounddevice
-    import soundfile
-
-else:
+if not g_isMacOS:
     # --------- import for Raspberry Pi -----------------------------------------
-    import pyaudio
-    import wave
-    from ctypes import *
     import RPi.GPIO as GPIO
-    import threading
     from queue import Queue
 
 
 
 # Global constants
 LOOPS_MAX = 10 # Set the number of times to loop when in auto mode
+ESTIMATE_PERCENTILE = 75 # percentile of recent latencies used to guess how long a step will take
+IDLE_CHECK_MS = 1000 # how often to check whether the idle images should be shown
+MAX_QUEUED_PRESSES = 1 # button presses while busy that are kept to be handled afterwards
+BUTTON_DEBOUNCE_MS = 300 # button edges this close together are taken as one press
 
 # Prompt for abstraction
 # PROMPT_FOR_ABSTRACTION = "What is the most interesting concept in the following text \
@@ -241,6 +257,7 @@ BLINK3 = (0.3, 0.2)
 BLINK4 = (0.2, 0.2)
 BLINK_STOP = (-1, -1)
 BLINK_DIE = (-2, -2)
+LED_USE_PWM = (-3, -3) # blink with the GPIO library's PWM from now on
 
 if not g_isMacOS:
     # Define the GPIO pins for RPi
@@ -301,6 +318,103 @@ class g_args:
     # if true, then use S3 to store user images and pop a QR code to allow download of displayed images
     useS3 = True
 
+    # seconds of audio kept from before the button press (0 = microphone only opened when recording)
+    prerollSeconds = 0
+
+    # how audio is sent for transcription: raw, or trimmed and resampled to 16 kHz as wav, flac or ogg
+    audioFormat = "wav"
+
+    # speech to text backend: "openai" or "local", and its model (None for the backend default)
+    sttBackend = "openai"
+    sttModel = None
+
+    # if true, transcribe with both backends and log how long each took
+    sttCompare = False
+
+    # how keywords are extracted from long transcripts: "llm", "local", or "auto" (local for medium length ones)
+    abstractionMode = "llm"
+
+    # in auto mode, transcripts of up to this many words use the local extractor
+    localKeywordsWords = 40
+
+    # seconds to wait for the LLM before using the local extractor instead (0 = wait for ever)
+    abstractionDeadline = 8
+
+    # how generated images are returned: "b64" inline in the response, or "url" to download
+    imageTransfer = "b64"
+
+    # four image mode: make four single image requests at once instead of one request for four
+    imageFanout = False
+
+    # single image mode (-m): make two requests and keep whichever finishes first
+    imageRace = False
+
+    # most image requests in flight at once
+    imageConcurrency = 4
+
+    # with fan-out or race, seconds to wait before showing what has arrived (0 = wait for all)
+    imageDeadline = 0
+
+    # if true, show each image on the screen as soon as it arrives
+    progressiveDisplay = True
+
+    # start a duplicate image request when one runs past this percentile of recent latencies (0 = never)
+    hedgePercentile = 0
+
+    # most duplicate image requests started in an hour
+    hedgeBudgetPerHour = 10
+
+    # if true, remember transcripts by a hash of the audio so replayed audio isn't sent again
+    useTranscriptCache = True
+
+    # if true, also keep transcripts of live audio on disk; audio files given with -w always are
+    transcriptCacheOnDisk = False
+
+    # most abstracts remembered in memory (0 = always ask the LLM)
+    abstractCacheSize = 200
+
+    # if true, abstracts are also kept on disk so they survive a restart
+    abstractCacheOnDisk = False
+
+    # file of terms that reject or rewrite prompts before they are sent, not used if it doesn't exist
+    promptScreenFile = "prompt_screen.txt"
+
+    # megabytes of idle display pictures kept decoded and resized (0 = prepare none ahead of time)
+    idleCacheMB = 64
+
+    # if true, blink the LED with the GPIO library's PWM rather than timing it on the LED thread
+    useLedPWM = False
+
+    # seconds from the press to the picture to aim for, taking quicker paths when at risk (0 = no target)
+    latencyTarget = 0
+
+    # if true, when a picture can't be made show the most similar approved picture instead of an error
+    useFallbackImage = True
+
+    # seconds to wait for the picture before giving up on it and showing a fallback or error (0 = wait for ever)
+    generationDeadline = 40
+
+    # hours a picture is reused for the same keywords and modifier (0 = don't reuse pictures)
+    imageCacheHours = 0
+
+    # megabytes of pictures the image cache may refer to
+    imageCacheMB = 200
+
+    # if true, when a cached picture is shown make a fresh one in the background
+    imageCacheRefresh = False
+
+    # recordings longer than this many seconds are split and the pieces transcribed in parallel (0 = never split)
+    segmentSeconds = 30
+
+    # most segments being transcribed at once
+    transcribeWorkers = 4
+
+    # seconds of trailing silence that end a recording early (0 = always record the full duration)
+    endpointSilence = 0
+
+    # shortest recording allowed when ending early on silence
+    endpointMinimum = 2
+
 
 
 # global window variables
@@ -314,10 +428,72 @@ class globalWindowVars:
     # when true, the program is quitting
     isQuitting = False
 
+    # the microphone, opened once at start up
+    audioDevice = None
+
+    # how generated images are returned: "b64" inline in the response, or "url" to download
+    imageTransfer = "b64"
+
+    # image generation fan-out: separate requests per image, a race for the single image,
+    # how many requests may run at once and how long to wait before settling for what has arrived
+    imageFanout = False
+    imageRace = False
+    imageConcurrency = 4
+    imageDeadline = 0
+
+    # hedged image requests: start a duplicate when a call passes this percentile of recent 
+    # latencies (0 = never), at most hedgeBudget.per_hour times an hour
+    hedgePercentile = 0
+    hedgeBudget = None
+
+    # background microphone capture with pre-roll, None when not in use
+    preRoll = None
+
+    # speech to text backend, and a second one to compare it against when --stt_compare is used
+    sttBackend = None
+    sttCompareBackend = None
+
+    # transcripts of audio already heard, keyed by a hash of the audio; None when not in use
+    transcriptCache = None
+
+    # pictures already made, keyed by keywords, modifier and image mode; None when not in use
+    imageCache = None
+
+    # abstracts already made, keyed by the transcript and the abstraction prompt; None when not in use
+    abstractCache = None
+
+    # captions of pictures made, to find a similar one when a picture can't be made; None when not in use
+    fallbackIndex = None
+
+    # terms that reject or rewrite a prompt before it is sent; None when not in use
+    promptScreen = None
+
+    # button presses waiting while a picture is being made
+    queuedPresses = 0
+
+    # runs audioToPicture off the Tk thread, so the windows keep responding while a picture is made
+    pipelineExecutor = None
+    isPipelineBusy = False
+
+    # button presses and typed commands as (kind, value, time), added on the Tk thread by the input
+    # handlers, which then write isInputReady to wake waitForInput()
+    inputEvents = collections.deque()
+    isInputReady = None
+
+    # when the button press being handled happened, to measure how soon recording starts
+    lastPressTime = None
+
+    # root.after ids of the pending hides of timed messages, by window
+    overlayTimers = {}
+
+    # prepares the idle display pictures ahead of time; None when not in use
+    idleRotation = None
+
 gw = globalWindowVars()
 
-# XXX client = OpenAI()  # must have set up your key in the shell as noted in comments above
-client = openai
+# OpenAI client with pooled connections, timeouts and retries. Created in main() because
+# it needs the key to have been set up in the shell as noted in comments above
+client = None
 
 # set up logging
 logger = logging.getLogger(__name__) # parameter: -d 1
@@ -336,6 +512,64 @@ logToFile.addHandler(handler)
 root = tk.Tk()
 root.withdraw()  # Hide the root window
 
+# Tk may only be used from the thread that created it. Other threads post their 
+# window updates here as (future, function, args, kwargs) and drainUIQueue() runs them
+uiQueue = queue.Queue()
+
+# a byte written to this pipe wakes the Tk event loop to run what was posted, so it isn't polled
+uiWakeRead, uiWakeWrite = os.pipe()
+os.set_blocking(uiWakeRead, False)
+os.set_blocking(uiWakeWrite, False)
+
+
+def postToUIThread(function, *args, **kwargs):
+    '''run function(*args, **kwargs) on the Tk thread; return a Future for its result'''
+    future = Future()
+    if threading.current_thread() is threading.main_thread():
+        future.set_result(function(*args, **kwargs))
+    else:
+        uiQueue.put((future, function, args, kwargs))
+        try:
+            os.write(uiWakeWrite, b"x")
+        except BlockingIOError:
+            pass    # the pipe is full, so the Tk thread has a wake up waiting already
+    return future
+
+
+def onUIThread(function):
+    '''decorator for window updates: called from another thread, wait while the Tk thread runs it'''
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        future = postToUIThread(function, *args, **kwargs)
+        while True:
+            try:
+                return future.result(timeout=0.5)
+            except FuturesTimeoutError:
+                # once quitting, the Tk thread won't run it and waiting would keep the program from exiting
+                if gw.isQuitting:
+                    raise RuntimeError("Quitting, window update not done")
+    return wrapper
+
+
+def drainUIQueue(file=None, mask=None):
+    '''Tk file handler for uiWakeRead: run the window updates posted by other threads'''
+    # empty the pipe first, so a post made while draining wakes the loop again rather than being missed
+    try:
+        while os.read(uiWakeRead, 4096):
+            pass
+    except BlockingIOError:
+        pass
+
+    while True:
+        try:
+            future, function, args, kwargs = uiQueue.get_nowait()
+        except queue.Empty:
+            break
+        try:
+            future.set_result(function(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+
 
 if not g_isMacOS:
     # --------- Raspberry Pi specific code -----------------------------------------
@@ -350,50 +584,78 @@ if not g_isMacOS:
     # Set up pin 10 as an input for the start button
     GPIO.setup(BUTTON_GO, GPIO.IN, pull_up_down=BUTTON_PULL_UP_DOWN)
 
+    # the button interrupts rather than being polled. The callback runs on the GPIO library's thread, 
+    # so it notes the time and hands the press to the Tk thread
+    def buttonInterrupt(channel):
+        postToUIThread(queueButtonPress, time.time())
+
+    GPIO.add_event_detect(BUTTON_GO, GPIO.FALLING if BUTTON_PRESSED == GPIO.LOW else GPIO.RISING, 
+                          callback=buttonInterrupt, bouncetime=BUTTON_DEBOUNCE_MS)
+
     # Define a function to blink the LED
     # This function is run on a thread
     # Communicate by putting a tuple of (onTime, offTime) in the qBlinkControl queue
+    # The thread sleeps on the queue: for ever when the LED is steady, and for the rest 
+    # of the on or off time when blinking, so a change takes effect straight away
     #
     def blink_led(q):
         # print("Starting LED thread") # why do I need to have this for the thread to work?
         logger.info("logging, Starting LED thread")
 
         # initialize the LED
-        isBlinking = False
+        blink_time = BLINK_STOP
+        isLedOn = False
+        pwm = None          # set when the GPIO library's PWM blinks the LED instead of this thread
         GPIO.output(LED_RED, GPIO.LOW)
 
         while True:
             # Get the blink time from the queue
-            try:
-                blink_time = q.get_nowait()
-            except:
-                blink_time = None
-
-            if blink_time is None:
-                # no change
-                pass
-            elif blink_time[0] == -2:
+            if blink_time == BLINK_STOP or pwm is not None:
+                # nothing to time here, wait for the next change
+                newBlinkTime = q.get()
+            else:
+                try:
+                    newBlinkTime = q.get(timeout=blink_time[0] if isLedOn else blink_time[1])
+                except queue.Empty:
+                    # the on or off time is up
+                    isLedOn = not isLedOn
+                    GPIO.output(LED_RED, GPIO.HIGH if isLedOn else GPIO.LOW)
+                    continue
+
+            if newBlinkTime == BLINK_DIE:
                 # die
                 logger.info("LED thread dying")
+                if pwm is not None:
+                    pwm.stop()
+                GPIO.output(LED_RED, GPIO.LOW)
                 break
-            elif blink_time[0] == -1:
+
+            if newBlinkTime == LED_USE_PWM:
+                pwm = GPIO.PWM(LED_RED, 1)
+                isPwmRunning = False
+                newBlinkTime = blink_time   # carry on with the current pattern
+
+            blink_time = newBlinkTime
+            onTime, offTime = blink_time
+            if blink_time == BLINK_STOP:
                 # stop blinking
+                if pwm is not None and isPwmRunning:
+                    pwm.stop()
+                    isPwmRunning = False
+                isLedOn = False
                 GPIO.output(LED_RED, GPIO.LOW)
-                isBlinking = False
+            elif pwm is not None:
+                pwm.ChangeFrequency(1 / (onTime + offTime))
+                dutyCycle = 100 * onTime / (onTime + offTime)
+                if isPwmRunning:
+                    pwm.ChangeDutyCycle(dutyCycle)
+                else:
+                    pwm.start(dutyCycle)
+                    isPwmRunning = True
             else:
-                onTime = blink_time[0]
-                offTime = blink_time[1]
-                isBlinking = True
-
-            if isBlinking:
-                # Turn the LED on
+                # start the new pattern with the LED on
+                isLedOn = True
                 GPIO.output(LED_RED, GPIO.HIGH)
-                # Wait for blink_time seconds
-                time.sleep(onTime)
-                # Turn the LED off
-                GPIO.output(LED_RED, GPIO.LOW)
-                # Wait for blink_time seconds
-                time.sleep(offTime)
 
     # Create a new thread to blink the LED
     logger.info("Creating LED thread")
@@ -443,24 +705,30 @@ def showStatus(labelForStatusDisplay = None):
     total, used, free = shutil.disk_usage("/")
     freeSpace =  "{:.2f}".format(free / (1024*1024*1024)) + " GB"
 
+    audioMsg = "Audio: " + (gw.audioDevice.latency_report() if gw.audioDevice else "not open")
+    print(audioMsg)
+
+    cacheMsg = ("Transcript cache: " + (gw.transcriptCache.stats() if gw.transcriptCache else "off") + "\n"
+                + "Abstract cache: " + (gw.abstractCache.stats() if gw.abstractCache else "off") + "\n"
+                + "Prompt screen: " + (gw.promptScreen.stats() if gw.promptScreen else "off") + "\n"
+                + "Idle pictures: " + (gw.idleRotation.stats() + ", shown in " + latency.tracker("idle swap").summary() 
+                                       if gw.idleRotation else "off"))
+    print(cacheMsg)
+
     msg =("Status:\n\n" + ipMsg + "\n" + historyCount + "\n" 
         + oldestFileDate + "\n" + idleFileCount + "\n" 
-        + "Free Space: " + freeSpace )
+        + "Free Space: " + freeSpace + "\n" + audioMsg + "\n" + cacheMsg )
 
-    display_text_in_status_window(msg, labelForStatusDisplay)
-    # sleep for 10 seconds
-    time.sleep(10)
-    display_text_in_status_window()
+    # shown for 10 seconds, without holding up anything else
+    display_text_in_status_window(msg, labelForStatusDisplay, seconds=10)
 
 def showCommands(labelForStatusDisplay = None):
     '''show the commands that can be used'''
     msg = "Valid Spoken Commands:\n\n" + \
         "    show status\n"+ \
         "    show commands\n"
-    display_text_in_status_window(msg, labelForStatusDisplay)
-    # sleep for 10 seconds
-    time.sleep(10)
-    display_text_in_status_window()
+    # shown for 10 seconds, without holding up anything else
+    display_text_in_status_window(msg, labelForStatusDisplay, seconds=10)
 
 
 # create an array of keywords and functions to call when the keyword is found
@@ -482,108 +750,164 @@ def changeBlinkRate(blinkRate):
         pass
 
 
-def recordAudioFromMicrophone(duration):
-    '''record duration seconds of audio from the default microphone to a file and return the sound file name'''
+def openAudioDevice(prerollSeconds=0):
+    '''
+    open the microphone once for the life of the program
+    if prerollSeconds is set, keep it running on a background thread, remembering that much audio
+    '''
+    global gw
+
+    gw.audioDevice = audio_device.AudioDeviceManager(use_sounddevice=g_isMacOS)
+    gw.audioDevice.open()
+    atexit.register(closeAudioDevice)
+
+    if prerollSeconds > 0:
+        gw.audioDevice.start()
+        gw.preRoll = audio_capture.PreRollRecorder(gw.audioDevice.read_chunk, gw.audioDevice.sample_rate, prerollSeconds)
+        gw.preRoll.start()
+        logger.info("Pre-roll capture started, keeping %.1f seconds", prerollSeconds)
 
-    soundFileName = 'recording.wav'
-    
-    # delete file recording.wav if it exists
-    try:
-        os.remove(soundFileName)
-    except:
-        pass # do nothing   
-    
-    if g_isMacOS:
-        # print the devices
-        # print(sd.query_devices())  # in case you have trouble with the devices
 
-        # Set the sample rate and number of channels for the recording
-        sample_rate = int(sounddevice.query_devices(1)['default_samplerate'])
-        channels = 1
+def closeAudioDevice():
+    '''stop any background capture and release the microphone'''
+    global gw
 
-        logger.debug('sample_rate: %d; channels: %d', sample_rate, channels)
+    if gw.preRoll is not None:
+        if not gw.preRoll.stop():
+            # closing the stream under a read that is still running can crash PortAudio,
+            # leave it for the operating system to release as the program exits
+            logger.warning("Pre-roll thread didn't stop, leaving the audio device open")
+            gw.audioDevice = None
+        gw.preRoll = None
+    if gw.audioDevice is not None:
+        gw.audioDevice.close()
+        gw.audioDevice = None
 
-        logger.info("Recording %d seconds...", duration)
-        # Record audio from the default microphone
-        recording = sounddevice.rec(
-            int(duration * sample_rate), 
-            samplerate=sample_rate, 
-            channels=channels
-            )
 
-        # Wait for the recording to finish
-        sounddevice.wait()
+def recordAudioFromMicrophone(duration, silenceSeconds=0, minSeconds=2):
+    '''
+    record up to duration seconds of audio from the default microphone and return it as CapturedAudio
+    if silenceSeconds is set, stop once the speaker has been quiet that long (after at least minSeconds)
+    '''
 
-        # Save the recording to a WAV file
-        soundfile.write(soundFileName, recording, sample_rate)
+    logger.info("Recording %d seconds...", duration)
 
+    def makeEndpointer(sample_rate):
+        if silenceSeconds <= 0:
+            return None
+        return audio_capture.Endpointer(sample_rate, silence_seconds=silenceSeconds, min_seconds=minSeconds)
+
+    device = gw.audioDevice
+    if gw.preRoll is not None:
+        # the microphone is already running, the recording starts with the pre-roll audio
+        audio = gw.preRoll.record(duration, makeEndpointer(device.sample_rate))
     else:
+        device.start()
+        try:
+            audio = audio_capture.record(device.read_chunk, device.sample_rate, duration, 
+                                         endpointer=makeEndpointer(device.sample_rate))
+        finally:
+            # the stream stays open, ready for the next recording
+            device.stop()
 
-        # RPi
- 
-        # all this crap because the ALSA library can't police itself
-        ERROR_HANDLER_FUNC = CFUNCTYPE(None, c_char_p, c_int, c_char_p, c_int, c_char_p)
-        def py_error_handler(filename, line, function, err, fmt):
-            pass #nothing to see here
-        c_error_handler = ERROR_HANDLER_FUNC(py_error_handler)
-        asound = cdll.LoadLibrary('libasound.so')
-        # Set error handler
-        asound.snd_lib_error_set_handler(c_error_handler)
-        # Initialize PyAudio
-        pa = pyaudio.PyAudio()
-        # Reset to default error handler
-        asound.snd_lib_error_set_handler(None)
-        # now on with the show, sheesh
+    logger.info("Recorded %.1f seconds", audio.duration)
+    logger.debug("Audio device: " + device.latency_report())
+    return audio
 
-        stream = pa.open(
-            format=pyaudio.paInt16,
-            channels=1,
-            rate=44100,
-            input=True,
-            frames_per_buffer=1024
-            ) #,input_device_index=2)
 
-        wf = wave.open(soundFileName,"wb")
-        wf.setnchannels(1)
-        wf.setsampwidth(pa.get_sample_size(pyaudio.paInt16))
-        wf.setframerate(44100)
+def transcribeAudio(sound, settings):
+    '''
+    condition the audio, transcribe it and return the transcript
+    sound is CapturedAudio or a file name; settings.audioFormat "raw" sends it as recorded
+    recordings longer than settings.segmentSeconds are split and the pieces transcribed in parallel
+    '''
 
-        # Write the audio data to the file
-        for i in range(0, int(44100/1024*10)):
+    audioFormat = settings.audioFormat
 
-            # Get the audio data from the microphone
-            data = stream.read(1024)
+    if not isinstance(sound, audio_capture.CapturedAudio):
+        if audioFormat == "raw":
+            # send the file exactly as given
+            return getTranscript(sound)
+        try:
+            sound = audio_conditioning.load_wav(sound)
+        except (wave.Error, EOFError) as e:
+            # not a WAV file we can read, let the transcription service deal with it
+            logger.info("Sending audio file as is: " + str(e))
+            return getTranscript(sound)
+
+    startTime = time.time()
+    if audioFormat == "raw":
+        # split if need be, but otherwise leave the audio as recorded
+        audioFormat = "wav"
+    else:
+        rawDuration, rawRate = sound.duration, sound.sample_rate
+        sound = audio_conditioning.resample(audio_conditioning.trim_silence(sound))
+        logger.info("Conditioned audio in %.2f s: %.1f s at %d Hz -> %.1f s at %d Hz", 
+                    time.time() - startTime, rawDuration, rawRate, sound.duration, sound.sample_rate)
 
-            # Write the audio data to the file
-            wf.writeframes(data)
+    if settings.segmentSeconds <= 0 or sound.duration <= settings.segmentSeconds:
+        return getTranscript(audio_conditioning.encode(sound, audioFormat))
 
-        # Close the microphone and the wave file
-        stream.close()
-        wf.close()
+    # long recording, transcribe the pieces at the same time
+    segments = audio_conditioning.split_at_silence(sound, settings.segmentSeconds)
+    logger.info("Transcribing %.1f s of audio as %d segments", sound.duration, len(segments))
+    segmentFiles = []
+    for count, segment in enumerate(segments):
+        segmentFile = audio_conditioning.encode(segment, audioFormat)
+        segmentFile.name = "segment" + str(count) + "-" + segmentFile.name
+        segmentFiles.append(segmentFile)
 
-    return soundFileName
+    texts = speech_to_text.transcribe_segments(segmentFiles, getTranscript, settings.transcribeWorkers)
+    transcript = speech_to_text.stitch_transcripts(texts)
 
+    logger.info("Transcribed %d segments in %.2f s", len(segments), time.time() - startTime)
+    logToFile.info("Stitched transcript text: " + transcript)
 
+    return transcript
 
 
-def getTranscript(wavFileName):
-    '''transcribe the audio file and return the transcript'''
+def getTranscript(audioFile):
+    '''transcribe the audio and return the transcript. audioFile is a file name or a file-like object'''
 
     # transcribe the recording
     logger.info("Transcribing...")
-    audio_file= open(wavFileName, "rb")
-    # used to use transcription.create, but the text comes back in the language spoken
-    responseTranscript = client.audio.translations.create(
-        model="whisper-1", 
-        file=audio_file)
-
-    # print the transcript object
-    loggerTrace.debug("Transcript object: " + str(responseTranscript))
+    if not isinstance(audioFile, io.BytesIO):
+        with open(audioFile, "rb") as f:
+            audioFile = io.BytesIO(f.read())
+            audioFile.name = os.path.basename(f.name)
+
+    # the same audio has been transcribed before when replaying files, so look for it first
+    cacheKey = None
+    if gw.transcriptCache is not None and gw.sttCompareBackend is None:
+        cacheKey = "%s|%s|%s" % (s2p_cache.hash_bytes(audioFile.getbuffer()), gw.sttBackend.name, gw.sttBackend.model)
+        cachedTranscript = gw.transcriptCache.get(cacheKey)
+        if cachedTranscript is not None:
+            logger.info("Transcript found in cache")
+            logToFile.info("Transcript text (cached): " + cachedTranscript)
+            return cachedTranscript
+
+    startTime = time.time()
+    transcript = gw.sttBackend.transcribe(audioFile)
+    elapsed = time.time() - startTime
+
+    if gw.sttCompareBackend is not None:
+        # transcribe again with the other backend so the two can be compared
+        audioFile.seek(0)
+        startTime = time.time()
+        otherTranscript = gw.sttCompareBackend.transcribe(audioFile)
+        otherElapsed = time.time() - startTime
+        compareMsg = "Speech to text comparison: %s/%s %.2f s \"%s\"; %s/%s %.2f s \"%s\"" % (
+            gw.sttBackend.name, gw.sttBackend.model, elapsed, transcript,
+            gw.sttCompareBackend.name, gw.sttCompareBackend.model, otherElapsed, otherTranscript)
+        logger.info(compareMsg)
+        logToFile.info(compareMsg)
 
-    transcript = responseTranscript.text 
     #remove trailing period
     transcript = transcript.rstrip(".")
 
+    if cacheKey is not None:
+        gw.transcriptCache.put(cacheKey, transcript)
+
     loggerTrace.debug("Transcript text: " + transcript)
     logToFile.info("Transcript text: " + transcript)
 
@@ -597,7 +921,8 @@ def getSummary(textInput):
     # summarize the transcript 
     logger.info("Summarizing...")
 
-    responseSummary = client.chat.completions.create(
+    responseSummary = openai_client.call_with_retries("chat",
+                        openai_client.for_endpoint(client, "chat").chat.completions.create,
                         model="gpt-4o-mini",
                         messages=[
                             {"role": "user", "content" : 
@@ -616,6 +941,18 @@ def getSummary(textInput):
 def getAbstractForImageGen(inputText):
     '''get keywords for the image generator and return the keywords'''
 
+    # replayed and near identical transcripts get the same abstract, so look for it first.
+    # the prompt is part of the key so changing it doesn't return abstracts made with the old one
+    cacheKey = None
+    if gw.abstractCache is not None:
+        cacheKey = s2p_cache.hash_bytes((PROMPT_FOR_ABSTRACTION + "|" 
+                                         + s2p_cache.normalise_text(inputText)).encode("utf-8"))
+        abstract = gw.abstractCache.get(cacheKey)
+        if abstract is not None:
+            logger.info("Abstract found in cache: " + abstract)
+            logToFile.info("Abstract (cached): " + abstract)
+            return abstract
+
     # extract the keywords from the summary
 
     logger.info("Extracting...")
@@ -624,7 +961,8 @@ def getAbstractForImageGen(inputText):
     prompt = PROMPT_FOR_ABSTRACTION + "'''" + inputText + "'''"
     loggerTrace.debug ("prompt for extract: " + prompt)
 
-    responseForImage = client.chat.completions.create(
+    responseForImage = openai_client.call_with_retries("chat",
+                        openai_client.for_endpoint(client, "chat").chat.completions.create,
                         model="gpt-4o-mini",
                         messages=[
                             {"role": "user", "content": prompt}
@@ -652,20 +990,160 @@ def getAbstractForImageGen(inputText):
     #remove trailing period
     abstract = abstract.rstrip(".")
 
+    if cacheKey is not None:
+        gw.abstractCache.put(cacheKey, abstract)
+
     logger.info("Abstract: " + abstract)
     logToFile.info("Abstract: " + abstract)
 
     return abstract
 
 
-def getImageURL(phrase):
-    '''get images and return the urls'''
+def callWithDeadline(deadline, function, *args):
+    '''
+    run function(*args) on a background thread and return its result
+    raises TimeoutError if it has not finished within deadline seconds (None waits for ever)
+    '''
+    result = {}
+
+    def worker():
+        try:
+            result["value"] = function(*args)
+        except Exception as e:
+            result["error"] = e
+
+    # a daemon thread so a call that never returns can't keep the program from exiting
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    thread.join(deadline)
+
+    if thread.is_alive():
+        raise TimeoutError(function.__name__ + " took longer than " + str(deadline) + " seconds")
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+
+def isAbstractionByLLM(transcript, settings):
+    '''true if getKeywordsForImageGen would ask the LLM for the keywords of transcript'''
+    if transcript.count(" ") <= 20:
+        # short transcripts are used as they are
+        return False
+    mode = settings.abstractionMode
+    return not (mode == "local" or (mode == "auto" and len(transcript.split()) <= settings.localKeywordsWords))
+
+
+def getKeywordsForImageGen(transcript, settings, isLocalOnly=False):
+    '''
+    get keywords for the image generator from a long transcript and return them
+    medium length transcripts use the local extractor, longer ones the LLM, falling back 
+    to the local extractor if the LLM fails or misses its deadline
+    isLocalOnly uses the local extractor whatever the length, to save time
+    '''
+
+    startTime = time.time()
+
+    if isLocalOnly or not isAbstractionByLLM(transcript, settings):
+        keywords = keyword_extract.extract_keywords(transcript)
+        source = "local"
+    else:
+        try:
+            keywords = callWithDeadline(settings.abstractionDeadline or None, getAbstractForImageGen, transcript)
+            latency.tracker("abstraction").record(time.time() - startTime)
+            source = "llm"
+        except Exception as e:
+            logger.warning("Abstraction failed, using local keywords: " + str(e))
+            keywords = keyword_extract.extract_keywords(transcript)
+            source = "local fallback"
+
+    if not keywords.strip():
+        # nothing but stopwords, use what was said
+        keywords = transcript
+        source = "transcript"
+
+    logger.info("Keywords from %s in %.2f s", source, time.time() - startTime)
+    logToFile.info("Keywords source: " + source)
+
+    return keywords
+
+
+def screenPrompt(keywords):
+    '''
+    return keywords with terms from the prompt screen rewritten
+    raises prompt_screen.PromptRejected if they contain a term that is rejected
+    '''
+    if gw.promptScreen is None:
+        return keywords
+
+    try:
+        screened = gw.promptScreen.screen(keywords)
+    except prompt_screen.PromptRejected as e:
+        # each of these is an image API call that would have been turned down
+        logger.info("Prompt rejected by the prompt screen: " + e.term)
+        logToFile.info("Prompt screen rejected: \"%s\" for term \"%s\" (%s)" % (keywords, e.term, gw.promptScreen.stats()))
+        raise
+
+    if screened != keywords:
+        logToFile.info("Prompt screen rewrote: \"%s\" to \"%s\"" % (keywords, screened))
+    return screened
+
+
+def planForLatencyTarget(settings, runStartTime, transcript):
+    '''
+    decide whether to take the quicker path so the picture is shown within settings.latencyTarget 
+    seconds of the press, using the recent latencies of each step. return (isAbstractionSkipped, isDraftImage)
+    '''
+
+    def estimate(name, cap=0):
+        # a pessimistic guess from recent calls, None until there have been a few
+        seconds = latency.tracker(name).percentile(ESTIMATE_PERCENTILE)
+        if seconds is not None and cap:
+            seconds = min(seconds, cap)
+        return seconds
+
+    elapsed = time.time() - runStartTime
+    # people waiting behind this press wait for it too, so share the target between them
+    target = settings.latencyTarget / (1 + gw.queuedPresses)
+
+    isAbstraction = isAbstractionByLLM(transcript, settings)
+    abstractionEstimate = estimate("abstraction", settings.abstractionDeadline) if isAbstraction else 0
+    usualPlan = currentImagePlan()
+    draftPlan = currentImagePlan(isDraft=True)
+    # fanned out requests are one image each
+    imageTracker = imageTrackerName(usualPlan.model, 1 if usualPlan.isFanout else usualPlan.numImages, usualPlan.size)
+    imageEstimate = estimate(imageTracker, usualPlan.deadline)
+    draftEstimate = estimate(imageTrackerName(draftPlan.model, draftPlan.numImages, draftPlan.size), draftPlan.deadline)
+
+    isAbstractionSkipped = False
+    isDraftImage = False
+    if elapsed + (abstractionEstimate or 0) + (imageEstimate or 0) > target:
+        isAbstractionSkipped = isAbstraction
+        # the draft image is only worth it if it isn't known to be slower
+        if elapsed + (imageEstimate or 0) > target and (draftEstimate is None or imageEstimate is None
+                                                        or draftEstimate < imageEstimate):
+            isDraftImage = True
+
+    def seconds(value):
+        return "unknown" if value is None else "%.1f s" % value
+
+    planMsg = ("Latency plan: target %.1f s (%d queued), elapsed %.1f s, abstraction %s, image %s, draft image %s"
+               " -> skip abstraction %s, draft image %s" % (target, gw.queuedPresses, elapsed, 
+               seconds(abstractionEstimate), seconds(imageEstimate), seconds(draftEstimate),
+               isAbstractionSkipped, isDraftImage))
+    logger.info(planMsg)
+    logToFile.info(planMsg)
+
+    return isAbstractionSkipped, isDraftImage
+
+
+def chooseImagePrompt(phrase, modifier=None):
+    '''pick a random modifier, or use the one given, and return the image prompt and the modifier used'''
 
     # pick random modifiers
     random.shuffle(IMAGE_MODIFIERS)
   
     # create the prompt for the image generator
-    modifierUsed = IMAGE_MODIFIERS[0]
+    modifierUsed = IMAGE_MODIFIERS[0] if modifier is None else modifier
     # if phrase contains stylistic information
     if ("in the style of" in phrase.lower() 
             or "as a painting by" in phrase.lower() 
@@ -678,87 +1156,190 @@ def getImageURL(phrase):
         # add a random modifier to the prompt
         prompt = f"Generate a picture {modifierUsed} WITHOUT ANY TEXT OR WRITING IN THE PICTURE for the following: '{phrase}'"
 
-    logger.info("Generating image...")
     logger.info("image prompt: " + prompt)
 
+    return prompt, modifierUsed
+
+
+def imageTrackerName(model, numImages, size):
+    '''the name of the latency tracker for image calls of this kind'''
+    return "image %s n=%d %s" % (model, numImages, size)
+
+
+class ImagePlan:
+    '''
+    the images to make for one press: how many, with which model, at what size and how they are requested
+    it is fixed when the press starts and passed along, so other presses can't change it part way through
+    '''
+
+    def __init__(self, isSingleImage, isDraft=False, isRace=False, isFanout=False, concurrency=4, deadline=0):
+        self.isDraft = isDraft
+        self.isSingleImage = isSingleImage or isDraft
+        if isDraft:
+            # the quicker single image used when the latency target is at risk
+            self.model, self.numImages, self.size = "dall-e-2", 1, "1024x1024"
+        elif isSingleImage:
+            self.model, self.numImages, self.size = "dall-e-3", 1, "1024x1024"
+        else:
+            self.model, self.numImages, self.size = "dall-e-2", 4, "512x512"
+        self.isRace = self.isSingleImage and isRace
+        self.isFanout = not self.isSingleImage and isFanout
+        self.concurrency = concurrency
+        self.deadline = deadline
+
+    @property
+    def mode(self):
+        return "draft" if self.isDraft else "single" if self.isSingleImage else "four"
+
+
+def currentImagePlan(isDraft=False):
+    '''the ImagePlan for the image settings given on the command line'''
+    return ImagePlan(gw.single_image, isDraft, gw.imageRace, gw.imageFanout, gw.imageConcurrency, gw.imageDeadline)
+
+
+def getImageURL(prompt, plan, numImages):
+    '''make one image generation call and return the response items, holding either a url or the image in base64'''
+
+    logger.info("Generating image...")
+
     # use openai to generate a picture based on the summary
-    if not gw.single_image:
-        try:
-            responseImage = client.images.generate(
-                prompt= prompt,
-                n=4,
-                size="512x512")
-        except Exception as e:
-            print("\n\n\n")
-            print(e)
-            print("\n\n\n")
-            raise (e)
-            
-        loggerTrace.debug("responseImage: " + str(responseImage))
+    # images come back inline as base64, or as urls to download them from
+    imageClient = openai_client.for_endpoint(client, "image")
+    responseFormat = "b64_json" if gw.imageTransfer == "b64" else "url"
+    imageArguments = dict(prompt=prompt, model=plan.model, n=numImages, size=plan.size, response_format=responseFormat)
+
+    # latencies of real calls of this kind, used to decide when a call is slow enough to hedge
+    imageLatency = latency.tracker(imageTrackerName(plan.model, numImages, plan.size))
+
+    def generate():
+        callStartTime = time.time()
+        response = openai_client.call_with_retries("image", imageClient.images.generate, **imageArguments)
+        imageLatency.record(time.time() - callStartTime)
+        return response
+
+    hedgeAfter = imageLatency.percentile(gw.hedgePercentile) if gw.hedgePercentile else None
+    startTime = time.time()
+    try:
+        responseImage = latency.hedged_call(generate, hedgeAfter, gw.hedgeBudget)
+    except Exception as e:
+        print("\n\n\n")
+        print(e)
+        print("\n\n\n")
+        raise (e)
 
-        image_url = [responseImage.data[0].url] * 4
-        image_url[1] = responseImage.data[1].url
-        image_url[2] = responseImage.data[2].url
-        image_url[3] = responseImage.data[3].url
-    
-    else: 
-        try:
-            responseImage = client.images.generate(
-                prompt= prompt,
-                model = "dall-e-3",
-                n=1,
-                size="1024x1024"
-                )
-        except Exception as e:
-            print("\n\n\n")
-            print(e)
-            print("\n\n\n")
-            raise (e)
-            
+    logToFile.info("Image timing: transfer %s, generate %.2f s, recent %s" % 
+                   (gw.imageTransfer, time.time() - startTime, imageLatency.summary()))
+    if responseFormat == "url":
         loggerTrace.debug("responseImage: " + str(responseImage))
+    else:
+        # don't fill the log with base64
+        loggerTrace.debug("responseImage: %d images as b64_json" % len(responseImage.data))
 
-        image_url = [responseImage.data[0].url]
+    return list(responseImage.data)
 
-    return image_url, modifierUsed
 
+def generateOneImage(prompt, plan):
+    '''generate a single image and return it as a PIL image'''
+    return image_fetch.load_image(getImageURL(prompt, plan, 1)[0])
 
-def postProcessImages(imageURLs, imageModifiers, keywords, timestr, filePrefix):
-    '''reformat the images for display and return the new file name'''
 
-    # save the images from a urls into imgObjects[]
-    imgObjects = []
-    for numURL in range(len(imageURLs)):
+def generateImages(prompt, plan):
+    '''
+    generate the images for prompt as given by plan, an ImagePlan, yielding (index, PIL image) as each one is ready
+    with --fanout each of the four images is its own request, and with --race two requests 
+    are made for the single image; either way plan.deadline can cut the wait short
+    '''
+
+    numImages = plan.numImages
+    isRace = plan.isRace
+    isFanout = plan.isFanout
+
+    if not (isRace or isFanout):
+        # one request for all the images, then decode or download them all at once
+        imageData = getImageURL(prompt, plan, numImages)
+        startTime = time.time()
+        yield from image_fetch.fetch_images_as_completed(imageData)
+        logToFile.info("Image timing: transfer %s, fetch %.2f s" % (gw.imageTransfer, time.time() - startTime))
+        return
+
+    # each request makes one image; a race makes two requests for image 0 and keeps the first
+    slots = [0, 0] if isRace else list(range(numImages))
+    startTime = time.time()
+    executor = ThreadPoolExecutor(max_workers=plan.concurrency, thread_name_prefix="image")
+    futures = {executor.submit(generateOneImage, prompt, plan): slot for slot in slots}
+    delivered = set()
+    lastError = None
+    try:
+        for future in as_completed(futures, timeout=plan.deadline or None):
+            slot = futures[future]
+            try:
+                image = future.result()
+            except Exception as e:
+                logger.warning("Image request for slot %d failed: %s", slot, e)
+                lastError = e
+                continue
+            if slot in delivered:
+                continue
+            delivered.add(slot)
+            logger.info("Image %d ready after %.2f s", slot, time.time() - startTime)
+            yield slot, image
+            if len(delivered) == numImages:
+                break
+    except FuturesTimeoutError:
+        logger.warning("Image deadline of %.1f s passed with %d of %d images", 
+                       plan.deadline, len(delivered), numImages)
+        logToFile.info("Image deadline passed with %d of %d images" % (len(delivered), numImages))
+    finally:
+        # don't wait for requests that lost the race or missed the deadline
+        executor.shutdown(wait=False, cancel_futures=True)
 
-        fileName = "history/" + "image" + str(numURL) + ".png"
-        urllib.request.urlretrieve(imageURLs[numURL], fileName)
+    if not delivered and lastError is not None:
+        raise lastError
 
-        img = Image.open(fileName)
 
-        imgObjects.append(img)
+def postProcessImages(imageSource, plan, imageModifiers, keywords, timestr, filePrefix, onProgress=None):
+    '''
+    combine the images as they arrive from imageSource, a sequence of (index, PIL image), 
+    laid out for plan, an ImagePlan, add the caption and return the new file name. 
+    Images that never arrive are left as placeholders
+    if given, onProgress(image) is called with the partly built image each time one arrives
+    '''
 
-    # combine the images into one image
-    #widths, heights = zip(*(i.size for i in imgObjects))
-    if not gw.single_image:
+    # lay out the combined image
+    if not plan.isSingleImage:
         total_width = 512*2
         max_height = 512*2 + 50
-        new_im = Image.new('RGB', (total_width, max_height))
         locations = [(0,0), (512,0), (0,512), (512,512)]
-        count = -1
-        for loc in locations:
-            count += 1
-            new_im.paste(imgObjects[count], loc)
+        imageSize = 512
     else:
         total_width = 1024
         max_height = 1024 + 50
-        new_im = Image.new('RGB', (total_width, max_height))
-        new_im.paste(imgObjects[0], (0,0))
+        locations = [(0,0)]
+        imageSize = 1024
+    new_im = Image.new('RGB', (total_width, max_height))
+
+    # paste each image in as it arrives
+    received = set()
+    for index, img in imageSource:
+        new_im.paste(img, locations[index])
+        received.add(index)
+        if onProgress is not None:
+            onProgress(new_im)
 
+    if not received:
+        raise RuntimeError("No images were generated in time")
+
+    draw = ImageDraw.Draw(new_im)
+    font = ImageFont.truetype("arial.ttf", 18)
+    for index, loc in enumerate(locations):
+        if index not in received:
+            # placeholder for an image that didn't arrive in time
+            draw.rectangle((loc, (loc[0] + imageSize, loc[1] + imageSize)), fill="#333333")
+            draw.text((loc[0] + 20, loc[1] + imageSize // 2), "This image did not arrive in time", (200,200,200), font=font)
 
     # add text at the bottom
     imageCaption = f'{keywords} {imageModifiers}'
-    draw = ImageDraw.Draw(new_im)
     draw.rectangle(((0, new_im.height - 50), (new_im.width, new_im.height)), fill="black")
-    font = ImageFont.truetype("arial.ttf", 18)
     # decide if text will exceed the width of the image
     #textWidth, textHeight = font.getsize(text)
     draw.text((10, new_im.height - 30), imageCaption, (255,255,255), font=font)
@@ -770,6 +1351,102 @@ def postProcessImages(imageURLs, imageModifiers, keywords, timestr, filePrefix):
     return newFileName
 
 
+def imageCacheKey(keywords, plan):
+    '''
+    the image cache key for a picture of keywords made as given by plan
+    the modifier is picked at random for each press, so it is stored with the picture rather than in the key
+    '''
+    return "%s|%s" % (s2p_cache.normalise_text(keywords), plan.mode)
+
+
+def getCachedImage(keywords, plan):
+    '''return (file name, modifier) of a picture already made for these keywords, or None'''
+    if gw.imageCache is None:
+        return None
+
+    cacheKey = imageCacheKey(keywords, plan)
+    cached = gw.imageCache.get(cacheKey)
+    if cached is None:
+        return None
+
+    cached = json.loads(cached)
+    if not os.path.exists(cached["file"]):
+        # the picture has been moved or deleted since
+        gw.imageCache.delete(cacheKey)
+        return None
+
+    logger.info("Image found in cache: " + cached["file"])
+    logToFile.info("Image cache hit: " + cacheKey)
+    return cached["file"], cached["modifier"]
+
+
+def cacheImage(keywords, imageModifiers, plan, fileName):
+    '''remember the picture made for these keywords and the modifier used'''
+    if gw.imageCache is not None:
+        gw.imageCache.put(imageCacheKey(keywords, plan), json.dumps({"file": fileName, "modifier": imageModifiers}), 
+                          os.path.getsize(fileName))
+
+
+def regenerateImageInBackground(prompt, plan, imageModifiers, keywords, filePrefix):
+    '''
+    make a fresh picture for a cached one on a background thread, so the next press gets it
+    everything it needs is passed in, so later presses can't change what it makes
+    '''
+
+    def regenerate():
+        try:
+            timestr = time.strftime("%Y%m%d-%H%M%S")
+            fileName = postProcessImages(generateImages(prompt, plan), plan, imageModifiers, keywords, timestr, filePrefix)
+            cacheImage(keywords, imageModifiers, plan, fileName)
+            if gw.fallbackIndex is not None:
+                gw.fallbackIndex.add(os.path.basename(fileName), keywords)
+            # not uploaded: nobody has seen this picture yet, let alone approved it
+            logToFile.info("Image cache refreshed: " + fileName)
+        except Exception as e:
+            logToFile.info("Image cache refresh failed: " + str(e))
+
+    threading.Thread(target=regenerate, name="imageRefresh", daemon=True).start()
+
+
+def seedFallbackIndex():
+    '''
+    add the approved pictures in idleDisplayFiles that aren't in the fallback index yet, 
+    using the text saved with them in history/; return how many were added
+    '''
+    added = 0
+    for name in os.listdir("idleDisplayFiles"):
+        if not name.endswith("-image.png") or name in gw.fallbackIndex:
+            continue
+        stem = os.path.join("history", name[:-len("-image.png")])
+        # the keywords are only saved for long transcripts, a short one was used as the keywords itself
+        for suffix in ("-keywords.txt", "-rawtranscript.txt"):
+            if os.path.exists(stem + suffix):
+                with open(stem + suffix, "r") as f:
+                    gw.fallbackIndex.add(name, f.read().strip())
+                added += 1
+                break
+    return added
+
+
+def findFallbackImage(keywords):
+    '''return the idle display picture whose caption best matches keywords, or None'''
+    if gw.fallbackIndex is None:
+        return None
+
+    startTime = time.time()
+    # only pictures that have been approved for display by copying them to idleDisplayFiles
+    approved = set(os.listdir("idleDisplayFiles"))
+    match = gw.fallbackIndex.search(keywords, approved)
+    if match is None:
+        logToFile.info("No fallback image for: " + keywords)
+        return None
+
+    name, similarity = match
+    logger.info("Fallback image %s, similarity %.2f, found in %.3f s", name, similarity, time.time() - startTime)
+    logToFile.info("Fallback image: %s similarity %.2f" % (name, similarity))
+    return os.path.join("idleDisplayFiles", name)
+
+
 def generateErrorImage(e, timestr):
     '''generate an image with the error message and return the new file name'''
 
@@ -961,6 +1638,10 @@ def create_main_window(usingHardwareButton):
 def update_main_window():
     global gw
 
+    # other threads leave this to the Tk thread, which is already running its event loop
+    if threading.current_thread() is not threading.main_thread():
+        return
+
     gw.windowMain.update_idletasks()
     gw.windowMain.update()
 
@@ -1080,12 +1761,30 @@ def create_status_window():
 
 
 
-def display_text_in_status_window(message=None, labelToUse=None):
+def cancelOverlayTimer(window):
+    '''forget the pending hide of a timed message in window, if there is one'''
+    timer = gw.overlayTimers.pop(window, None)
+    if timer is not None:
+        root.after_cancel(timer)
+
+
+def waitKeepingWindowsServiced(seconds):
+    '''wait for seconds on the Tk thread, running the event loop so windows and input keep working'''
+    isDone = tk.BooleanVar(value=False)
+    root.after(int(seconds * 1000), isDone.set, True)
+    gw.windowMain.wait_variable(isDone)
+
+
+@onUIThread
+def display_text_in_status_window(message=None, labelToUse=None, seconds=None):
     '''
     display message in the status window
     if labelToUse is None, then hide the window
+    if seconds is given, hide it again after that many seconds without waiting
     '''
     global gw
+
+    cancelOverlayTimer(gw.windowForStatus)
       
     if (labelToUse is None):
         gw.windowForStatus.withdraw() # Hide the message window
@@ -1101,13 +1800,20 @@ def display_text_in_status_window(message=None, labelToUse=None):
     gw.windowForMessages.update_idletasks()
     gw.windowForMessages.update()
 
+    if labelToUse is not None and seconds is not None:
+        gw.overlayTimers[gw.windowForStatus] = root.after(int(seconds * 1000), display_text_in_status_window)
+
 
-def display_text_in_message_window(message=None, labelToUse=None):
+@onUIThread
+def display_text_in_message_window(message=None, labelToUse=None, seconds=None):
     '''
     display message in the message window
     if labelToUse is None, then hide the window
+    if seconds is given, hide it again after that many seconds without waiting
     '''
     global gw
+
+    cancelOverlayTimer(gw.windowForMessages)
       
     if (labelToUse is None):
         gw.windowForMessages.withdraw() # Hide the message window
@@ -1119,7 +1825,50 @@ def display_text_in_message_window(message=None, labelToUse=None):
     gw.windowForMessages.update_idletasks()
     gw.windowForMessages.update()
 
+    if labelToUse is not None and seconds is not None:
+        gw.overlayTimers[gw.windowForMessages] = root.after(int(seconds * 1000), display_text_in_message_window)
+
+
+@onUIThread
+def display_pil_image(img, label):
+    '''
+    resize a PIL image to fit the main window, show it in label and return the displayed (width, height)
+    '''
+
+    global gw
+
+    #resize the image to fit the window
+    resizeFactor = 0.95
+    window_height = gw.windowMain.winfo_height()
+    labelDimensions = int(window_height * resizeFactor)
+    label.configure(width=labelDimensions, height=labelDimensions)
+    
+    new_width = int(labelDimensions * img.width / img.height)
+    new_height = int(labelDimensions)
+    img = img.resize((new_width,new_height), Image.NEAREST)
+
+    # Convert the image to a PhotoImage
+    photoImage = ImageTk.PhotoImage(img)
+    label.configure(image=photoImage)
+    label.image = photoImage  # Keep a reference to the image to prevent it from being garbage collected
+
+    update_main_window()
+
+    return new_width, new_height
+
+
+@onUIThread
+def display_partial_image(img, label, labelQR = None):
+    '''
+    show a picture that is still being made, without its QR code and with the message window hidden
+    '''
+    if labelQR is not None:
+        labelQR.configure(image="")
+    display_text_in_message_window() # Hide the message window
+    display_pil_image(img, label)
+
 
+@onUIThread
 def display_image(image_path, label=None, labelQR = None):
     '''
     display an image in the window using the label object
@@ -1137,22 +1886,7 @@ def display_image(image_path, label=None, labelQR = None):
     # Open an image file
     try:
         img = Image.open(image_path)
-        #resize the image to fit the window
-        resizeFactor = 0.95
-        window_height = gw.windowMain.winfo_height()
-        labelDimensions = int(window_height * resizeFactor)
-        label.configure(width=labelDimensions, height=labelDimensions)
-        
-        new_width = int(labelDimensions * img.width / img.height)
-        new_height = int(labelDimensions)
-        img = img.resize((new_width,new_height), Image.NEAREST)
-
-        # Convert the image to a PhotoImage
-        photoImage = ImageTk.PhotoImage(img)
-        label.configure(image=photoImage)
-        label.image = photoImage  # Keep a reference to the image to prevent it from being garbage collected
-
-        update_main_window()
+        new_width, new_height = display_pil_image(img, label)
         skip_QR = False
 
     except Exception as e:
@@ -1180,9 +1914,25 @@ def display_image(image_path, label=None, labelQR = None):
 
     return label
 
+def display_rendition(rendition, label, labelQR = None):
+    '''
+    show an idle_rotation.Rendition, a picture already resized for the window, using the label objects
+    '''
+    label.configure(width=rendition.image.height, height=rendition.image.height)
+    photoImage = ImageTk.PhotoImage(rendition.image)
+    label.configure(image=photoImage)
+    label.image = photoImage  # Keep a reference to the image to prevent it from being garbage collected
+
+    if labelQR and gw.useS3 and rendition.qr is not None:
+        QR_photo = ImageTk.PhotoImage(rendition.qr)
+        labelQR.configure(image = QR_photo)
+        labelQR.image = QR_photo  # keep a reference to prevent garbage collection
+
+
 def display_random_history_image(labelForImageDisplay, labelQRForImage = None):
     '''
     display a random image from the idleDisplayFiles in the window using the label object
+    the next one is prepared in the background by gw.idleRotation, so showing it is quick
     '''
     # static variable to hold last time an image was displayed
     if not hasattr(display_random_history_image, "lastImageDisplayedTime"):
@@ -1192,17 +1942,33 @@ def display_random_history_image(labelForImageDisplay, labelQRForImage = None):
         
         display_random_history_image.lastImageDisplayedTime =  time.time()
 
-        # list all files in the idleDisplayFiles folder
-        idleDisplayFolder = "./idleDisplayFiles"
-        idleDisplayFiles = os.listdir(idleDisplayFolder)
-        #remove any non-png files from Files
-        imagesToDisplay = []
-        for file in idleDisplayFiles:
-            if file.endswith(".png"):
-                #add to the list
-                imagesToDisplay.append(file)
-        random.shuffle(imagesToDisplay) # randomize the list
-        display_image(idleDisplayFolder + "/" + imagesToDisplay[0], labelForImageDisplay, labelQRForImage)
+        windowSize = (gw.windowMain.winfo_width(), gw.windowMain.winfo_height())
+        startTime = time.time()
+        rendition = gw.idleRotation.take(windowSize) if gw.idleRotation is not None else None
+
+        if rendition is not None:
+            display_rendition(rendition, labelForImageDisplay, labelQRForImage)
+            swapLatency = latency.tracker("idle swap")
+            swapLatency.record(time.time() - startTime)
+            logger.debug("Idle image %s shown in %.3f s", rendition.path, time.time() - startTime)
+        else:
+            # nothing prepared yet, or the window has changed size
+            # list all files in the idleDisplayFiles folder
+            idleDisplayFolder = "./idleDisplayFiles"
+            idleDisplayFiles = os.listdir(idleDisplayFolder)
+            #remove any non-png files from Files
+            imagesToDisplay = []
+            for file in idleDisplayFiles:
+                if file.endswith(".png"):
+                    #add to the list
+                    imagesToDisplay.append(file)
+            random.shuffle(imagesToDisplay) # randomize the list
+            display_image(idleDisplayFolder + "/" + imagesToDisplay[0], labelForImageDisplay, labelQRForImage)
+            logger.debug("Idle image shown without preparing in %.3f s", time.time() - startTime)
+
+        if gw.idleRotation is not None:
+            # get the next one ready while this one is on show
+            gw.idleRotation.prefetch(windowSize)
         
         update_main_window()
 
@@ -1226,6 +1992,43 @@ def parseCommandLineArgs():
     parser.add_argument("-g", "--gokiosk", help="jump into Kiosk mode", action="store_true") # optional argument
     parser.add_argument("-q", "--use_s3", help = "try to store image files to AWS S3, and generate QRcodes", action="store_true")
     parser.add_argument("-m", "--mono_image", help = "create a single, large image using dall-e-3", action="store_true")
+    parser.add_argument("--audio_format", help = "trim and resample audio to 16 kHz before upload, raw sends it as recorded", 
+                        choices=audio_conditioning.AUDIO_FORMATS, default="wav")
+    parser.add_argument("--stt", help = "speech to text backend, local runs Whisper on this computer", 
+                        choices=speech_to_text.BACKENDS, default="openai")
+    parser.add_argument("--stt_model", help = "speech to text model, e.g. whisper-1 for openai or tiny, base for local", type=str, default=None)
+    parser.add_argument("--stt_compare", help = "also transcribe with the other backend and log the time each took", action="store_true")
+    parser.add_argument("--abstraction", help = "how keywords are found in long transcripts, auto uses local for medium length ones", 
+                        choices=["auto", "llm", "local"], default="llm")
+    parser.add_argument("--local_keywords_words", help = "in auto mode, transcripts of up to this many words use local keywords", type=int, default=40)
+    parser.add_argument("--abstraction_deadline", help = "seconds to wait for the LLM before using local keywords, 0 to wait for ever", type=float, default=8)
+    parser.add_argument("--no_transcript_cache", help = "always transcribe, even audio that has been transcribed before", action="store_true")
+    parser.add_argument("--transcript_cache_disk", help = "also keep transcripts of live audio on disk (always done with -w)", action="store_true")
+    parser.add_argument("--segment_seconds", help = "split recordings longer than this and transcribe the pieces in parallel, 0 to never split", type=float, default=30)
+    parser.add_argument("--transcribe_workers", help = "most segments transcribed at once", type=int, default=4)
+    parser.add_argument("-e", "--endpoint", help = "stop recording after this many seconds of silence once speech is heard", type=float, default=0)
+    parser.add_argument("--min_record", help = "shortest recording in seconds when using -e", type=float, default=2)
+    parser.add_argument("--image_transfer", help = "get generated images inline as base64 (b64) or download them from a url", 
+                        choices=["b64", "url"], default="b64")
+    parser.add_argument("--fanout", help = "generate the four images as four requests at once and show them as they arrive", action="store_true")
+    parser.add_argument("--race", help = "with -m, make two requests for the image and keep the first one back", action="store_true")
+    parser.add_argument("--image_concurrency", help = "most image requests in flight at once", type=int, default=4)
+    parser.add_argument("--image_deadline", help = "with --fanout or --race, seconds to wait before showing the images that have arrived", type=float, default=0)
+    parser.add_argument("--no_progressive", help = "wait for the finished picture instead of showing each image as it arrives", action="store_true")
+    parser.add_argument("--hedge", help = "start a duplicate image request when one takes longer than this percentile of recent requests, e.g. 90", type=float, default=0)
+    parser.add_argument("--idle_cache_mb", help = "megabytes of idle display pictures kept ready to show (0 = off)", type=float, default=64)
+    parser.add_argument("--led_pwm", help = "blink the LED with PWM rather than timing it on a thread (RPi only)", action="store_true")
+    parser.add_argument("--latency_target", help = "seconds from press to picture to aim for, skipping the LLM or making one quicker image when at risk", type=float, default=0)
+    parser.add_argument("--hedge_budget", help = "most duplicate image requests in an hour", type=int, default=10)
+    parser.add_argument("--abstract_cache", help = "number of abstracts remembered in memory (0 = off)", type=int, default=200)
+    parser.add_argument("--abstract_cache_disk", help = "also keep abstracts on disk so they survive a restart", action="store_true")
+    parser.add_argument("--prompt_screen", help = "file of terms that reject or rewrite prompts before they are sent", default="prompt_screen.txt")
+    parser.add_argument("--generation_deadline", help = "seconds to wait for a picture before showing a similar past one (0 = wait for ever)", type=float, default=40)
+    parser.add_argument("--no_fallback_image", help = "show an error, not a similar past picture, when a picture can't be made", action="store_true")
+    parser.add_argument("--image_cache", help = "reuse a picture for the same keywords and modifier for this many hours", type=float, default=0)
+    parser.add_argument("--image_cache_mb", help = "megabytes of pictures the image cache may refer to", type=float, default=200)
+    parser.add_argument("--image_cache_refresh", help = "when a cached picture is shown, make a fresh one in the background", action="store_true")
+    parser.add_argument("-p", "--preroll", help = "keep the microphone open and prepend this many seconds of audio from before the button press", type=float, default=0)
     args = parser.parse_args()
 
     # set the debug level
@@ -1243,6 +2046,48 @@ def parseCommandLineArgs():
     if args.use_s3: rtn.useS3 = True
     else:           rtn.useS3 = False
 
+    rtn.imageTransfer = args.image_transfer
+    rtn.progressiveDisplay = not args.no_progressive
+    rtn.abstractCacheSize = max(0, args.abstract_cache)
+    rtn.abstractCacheOnDisk = args.abstract_cache_disk
+    rtn.promptScreenFile = args.prompt_screen
+    rtn.useFallbackImage = not args.no_fallback_image
+    rtn.generationDeadline = max(0, args.generation_deadline)
+    rtn.imageCacheHours = max(0, args.image_cache)
+    rtn.imageCacheMB = max(0, args.image_cache_mb)
+    rtn.imageCacheRefresh = args.image_cache_refresh
+    rtn.hedgePercentile = min(100, max(0, args.hedge))
+    rtn.hedgeBudgetPerHour = max(0, args.hedge_budget)
+    rtn.latencyTarget = max(0, args.latency_target)
+    rtn.useLedPWM = args.led_pwm
+    rtn.idleCacheMB = max(0, args.idle_cache_mb)
+    rtn.imageFanout = args.fanout
+    rtn.imageRace = args.race
+    rtn.imageConcurrency = max(1, args.image_concurrency)
+    rtn.imageDeadline = max(0, args.image_deadline)
+
+    # seconds of audio to keep from before a recording starts, 0 turns it off
+    rtn.prerollSeconds = max(0, args.preroll)
+
+    rtn.audioFormat = args.audio_format
+
+    rtn.sttBackend = args.stt
+    rtn.sttModel = args.stt_model
+    rtn.sttCompare = args.stt_compare
+
+    rtn.abstractionMode = args.abstraction
+    rtn.localKeywordsWords = args.local_keywords_words
+    rtn.abstractionDeadline = max(0, args.abstraction_deadline)
+
+    rtn.useTranscriptCache = not args.no_transcript_cache
+    rtn.transcriptCacheOnDisk = args.transcript_cache_disk
+    rtn.segmentSeconds = max(0, args.segment_seconds)
+    rtn.transcribeWorkers = max(1, args.transcribe_workers)
+
+    # end recordings early once the speaker goes quiet
+    rtn.endpointSilence = max(0, args.endpoint)
+    rtn.endpointMinimum = max(0, args.min_record)
+
     # set flag for single large image (vs default of 4 small)
     if args.mono_image: rtn.single_image = True
     else:               rtn.single_image = False
@@ -1295,14 +2140,77 @@ def parseCommandLineArgs():
     return rtn
 
 
+def queueButtonPress(pressTime):
+    '''
+    add a button press to the input events; runs on the Tk thread
+    a press while a picture is being made waits for it, up to MAX_QUEUED_PRESSES of them
+    '''
+    if gw.isPipelineBusy:
+        if gw.queuedPresses >= MAX_QUEUED_PRESSES:
+            logger.info("Button pressed while busy, already have %d waiting", gw.queuedPresses)
+            return
+        gw.queuedPresses += 1
+        logToFile.info("Button pressed while busy, %d waiting" % gw.queuedPresses)
+
+    gw.inputEvents.append(("button", None, pressTime))
+    gw.isInputReady.set(True)
+
+
+def readCommandFromStdin(file, mask):
+    '''Tk file handler: add the command typed on stdin to the input events'''
+    line = sys.stdin.readline()
+    if line == "":
+        # end of file, nothing more will be typed
+        root.tk.deletefilehandler(sys.stdin)
+        return
+    gw.inputEvents.append(("command", line.strip(), time.time()))
+    gw.isInputReady.set(True)
+
+
+def waitForInput():
+    '''
+    run the Tk event loop until there is an input event and return it as (kind, value, time)
+    kind is "button" or "command"; ("quit", None, time) is returned when the program is quitting
+    '''
+    while not gw.inputEvents:
+        if gw.isQuitting:
+            return "quit", None, time.time()
+        # returns when isInputReady is written, by an input handler or by quitting
+        gw.windowMain.wait_variable(gw.isInputReady)
+    return gw.inputEvents.popleft()
+
+
+def runAudioToPicture(settings, labelForImageDisplay, labelForMessageDisplay, labelForStatusDisplay, filePrefix, labelQRForImage = None):
+    '''
+    run audioToPicture on the pipeline thread, keeping the windows serviced until it is done
+    window updates it makes are posted back to this thread, see onUIThread
+    '''
+    isDone = tk.BooleanVar(value=False)
+    gw.isPipelineBusy = True
+    future = gw.pipelineExecutor.submit(audioToPicture, settings, labelForImageDisplay, labelForMessageDisplay, 
+                                        labelForStatusDisplay, filePrefix, labelQRForImage)
+    future.add_done_callback(lambda f: postToUIThread(isDone.set, True))
+
+    # runs the Tk event loop, including drainUIQueue, until the pipeline thread sets isDone.
+    # If it had already finished, the callback set isDone before the wait and wait_variable
+    # would wait for a second write that never comes
+    if not future.done():
+        gw.windowMain.wait_variable(isDone)
+    gw.isPipelineBusy = False
+
+    # an error in the pipeline is raised here, as it was when it ran on this thread
+    future.result()
+
+
 def audioToPicture(settings, labelForImageDisplay, labelForMessageDisplay, labelForStatusDisplay, filePrefix, labelQRForImage = None ):
     '''
     main routine to process audio to picture
     '''
     # format a time string to use as a file name
     timestr = time.strftime("%Y%m%d-%H%M%S")
+    runStartTime = time.time()
 
-    soundFileName = ""
+    soundFile = None
     transcript = ""
     summary = ""
     keywords = ""
@@ -1317,7 +2225,7 @@ def audioToPicture(settings, labelForImageDisplay, labelForMessageDisplay, label
 
     if nextProcessStep == processStep.UseAudioFile:
         # use the audio file specified 
-        soundFileName = settings.inputFileName
+        soundFile = settings.inputFileName
         logger.info("Using audio file: " + settings.inputFileName)
         nextProcessStep = processStep.Transcribe
 
@@ -1361,18 +2269,26 @@ def audioToPicture(settings, labelForImageDisplay, labelForMessageDisplay, label
 
         changeBlinkRate(BLINK_FOR_AUDIO_CAPTURE)
 
+        if gw.lastPressTime is not None:
+            buttonLatency = latency.tracker("button to record")
+            buttonLatency.record(time.time() - gw.lastPressTime)
+            logToFile.info("Button to record: %.3f s, recent %s" % (time.time() - gw.lastPressTime, buttonLatency.summary()))
+            gw.lastPressTime = None
+
         # record audio from the default microphone
         display_text_in_message_window("Speak Now\r\nYou have 10 seconds", labelForMessageDisplay)
         if g_isMacOS: os.system('say "Recording."')
-        soundFileName = recordAudioFromMicrophone(settings.duration)
+        audio = recordAudioFromMicrophone(settings.duration, settings.endpointSilence, settings.endpointMinimum)
         display_text_in_message_window("Recording Complete, now analyzing", labelForMessageDisplay)
         if g_isMacOS: os.system('say "Recording complete."')
 
         if settings.isSaveFiles:
-            print("Saving audio file: " + soundFileName)
-            #copy the file to a new name with the time stamp
-            shutil.copy(soundFileName, "history/" + filePrefix + timestr + "-recording" + ".wav")
-            soundFileName = "history/" + filePrefix + timestr + "-recording" + ".wav"
+            # only touch the disk when asked to, the recording is otherwise kept in memory
+            audioFileName = "history/" + filePrefix + timestr + "-recording" + ".wav"
+            print("Saving audio file: " + audioFileName)
+            audio.save(audioFileName)
+
+        soundFile = audio
     
         changeBlinkRate(BLINK_STOP)
         nextProcessStep = processStep.Transcribe
@@ -1384,7 +2300,7 @@ def audioToPicture(settings, labelForImageDisplay, labelForMessageDisplay, label
         changeBlinkRate(BLINK1)
 
         # transcribe the recording
-        transcript = getTranscript(soundFileName)
+        transcript = transcribeAudio(soundFile, settings)
         logToFile.info("Transcript: " + transcript)
 
         if settings.isSaveFiles:
@@ -1435,6 +2351,13 @@ def audioToPicture(settings, labelForImageDisplay, labelForMessageDisplay, label
         """
 
 
+    # take quicker paths when the recent latencies say the picture would be late
+    isAbstractionSkipped = False
+    isDraftImage = False
+    if settings.latencyTarget > 0 and nextProcessStep in (processStep.Keywords, processStep.ImageCreate):
+        isAbstractionSkipped, isDraftImage = planForLatencyTarget(settings, runStartTime, transcript)
+    imagePlan = currentImagePlan(isDraftImage)
+
     # Keywords - set keywords
     if nextProcessStep == processStep.Keywords:
 
@@ -1444,7 +2367,7 @@ def audioToPicture(settings, labelForImageDisplay, labelForMessageDisplay, label
         # does transcript contain more than 20 blank spaces?
         if transcript.count(" ") > 20:
             # extract the keywords from the summary
-            keywords = getAbstractForImageGen(transcript) 
+            keywords = getKeywordsForImageGen(transcript, settings, isAbstractionSkipped)
             logToFile.info("Keywords: " + keywords)
 
             if settings.isSaveFiles:
@@ -1464,22 +2387,57 @@ def audioToPicture(settings, labelForImageDisplay, labelForMessageDisplay, label
 
         # use the keywords to generate images
         try:
-            imagesInfo = getImageURL(keywords)
+            # catch prompts the image API would turn down before paying for the round trip
+            keywords = screenPrompt(keywords)
+
+            # the same phrases come up again and again, see if this picture has been made before
+            cached = getCachedImage(keywords, imagePlan)
 
-            imageURLs = imagesInfo[0]
-            imageModifiers = imagesInfo[1]
+            if cached is not None:
+                # keep the modifier the picture was made with, so the caption and any refresh match it
+                newImageFileName, cachedModifiers = cached
+                prompt, imageModifiers = chooseImagePrompt(keywords, cachedModifiers)
+                if settings.imageCacheRefresh:
+                    regenerateImageInBackground(prompt, imagePlan, imageModifiers, keywords, filePrefix)
 
-            # combine the images into one image
-            newImageFileName = postProcessImages(imageURLs, imageModifiers, keywords, timestr, filePrefix)
+            else:
+                prompt, imageModifiers = chooseImagePrompt(keywords)
+
+                # set when the picture has taken too long and a fallback is shown instead
+                isAbandoned = threading.Event()
+
+                def showProgress(partialImage):
+                    # show each image as soon as it arrives, the caption is added at the end
+                    if not isAbandoned.is_set():
+                        display_partial_image(partialImage, labelForImageDisplay, labelQRForImage)
+
+                def makePicture():
+                    # combine the images into one image as they arrive
+                    fileName = postProcessImages(generateImages(prompt, imagePlan), imagePlan, imageModifiers, 
+                                                 keywords, timestr, filePrefix, 
+                                                 showProgress if settings.progressiveDisplay else None)
+                    # remembered even if it comes too late to be shown
+                    cacheImage(keywords, imageModifiers, imagePlan, fileName)
+                    if gw.fallbackIndex is not None:
+                        gw.fallbackIndex.add(os.path.basename(fileName), keywords)
+                    return fileName
+
+                # however the images are requested, don't wait past the deadline for them
+                try:
+                    newImageFileName = callWithDeadline(settings.generationDeadline or None, makePicture)
+                except TimeoutError:
+                    isAbandoned.set()
+                    logToFile.info("Picture not made within %.0f s" % settings.generationDeadline)
+                    raise
+
+                if gw.useS3:
+                     result = upload_to_s3_and_generate_qr( file_path = newImageFileName, S3_dir= "idleDisplayFiles")
 
             imageURLs = "file://" + os.getcwd() + "/" + newImageFileName
             logger.debug("imageURL: " + imageURLs)
 
             logToFile.info("Image file: " + newImageFileName)
 
-            if gw.useS3:
-                 result = upload_to_s3_and_generate_qr( file_path = newImageFileName, S3_dir= "idleDisplayFiles")
-
             changeBlinkRate(BLINK_STOP)
             nextProcessStep = processStep.DisplayImage  
 
@@ -1488,23 +2446,34 @@ def audioToPicture(settings, labelForImageDisplay, labelForMessageDisplay, label
             print ("AI Image Error: " + str(e))
             logToFile.info("AI Image Error: " + str(e), exc_info=True)
 
-            if 'content_policy_violation' in str(e):
+            errorKind = openai_client.classify_error(e)
+            logToFile.info("AI Image Error kind: " + errorKind.value)
+            isPromptRejected = isinstance(e, prompt_screen.PromptRejected) or errorKind == openai_client.ErrorKind.CONTENT_POLICY
+            if isPromptRejected:
                 # this is a common error, so we'll display a message to the user
                 msg = f'Content Policy Violation.  Your prompt may contain text that is not allowed by our safety system.'
-            elif 'something went wrong' in str(e):
-                msg = f'Something went wrong with the OpenAI image generation.  Please try again'
-            elif 'server had an error' in str(e):
+            elif errorKind == openai_client.ErrorKind.SERVER:
                 msg = f'OpenAI had an unspecified server error.  Please try again'
+            elif errorKind in (openai_client.ErrorKind.TIMEOUT, openai_client.ErrorKind.CONNECTION):
+                msg = f'We could not reach OpenAI in time.  Please try again'
+            elif errorKind == openai_client.ErrorKind.RATE_LIMIT:
+                msg = f'OpenAI is busy right now.  Please wait a moment and try again'
             else:
                 msg = f'We had an error:\n\r "{str(e)}" \n\r\n\rPlease try again.'
 
-            display_text_in_message_window(msg, labelForMessageDisplay)
-            time.sleep(5) # delay for 5 seconds
-            display_text_in_message_window() # Hide the message window
-            update_main_window()
+            # rather than an error, show the most similar picture that has been approved for display
+            # but not for a rejected prompt, a picture matching those words is the last thing to show
+            fallbackFileName = None if isPromptRejected else findFallbackImage(keywords)
+            if fallbackFileName is not None:
+                newImageFileName = fallbackFileName
+                changeBlinkRate(BLINK_STOP)
+                nextProcessStep = processStep.DisplayImage
+            else:
+                # hidden again after 5 seconds, or sooner if the next press shows a message
+                display_text_in_message_window(msg, labelForMessageDisplay, seconds=5)
 
-            changeBlinkRate(BLINK_STOP)
-            nextProcessStep = processStep.Done  
+                changeBlinkRate(BLINK_STOP)
+                nextProcessStep = processStep.Done  
         
 
 
@@ -1512,6 +2481,7 @@ def audioToPicture(settings, labelForImageDisplay, labelForMessageDisplay, label
     if nextProcessStep == processStep.DisplayImage:
         changeBlinkRate(BLINK_SLOW)
         logger.info("Displaying image...")
+        logToFile.info("Press to picture: %.1f s" % (time.time() - runStartTime))
 
         try:
             display_image(newImageFileName, labelForImageDisplay, labelQRForImage)
@@ -1540,6 +2510,7 @@ def main():
     # ----------------------
    
     global gw # so that the changes made in here will affect the global variables
+    global client
 
     # create a directory if one does not exist
     if not os.path.exists("history"):
@@ -1575,6 +2546,13 @@ def main():
     gw.useS3 = settings.useS3         # useS3 added to globals so it can be used as a switch in image creation and display 
     gw.kiosk_mode = settings.kiosk_mode
     gw.single_image = settings.single_image
+    gw.imageTransfer = settings.imageTransfer
+    gw.imageFanout = settings.imageFanout
+    gw.imageRace = settings.imageRace
+    gw.imageConcurrency = settings.imageConcurrency
+    gw.imageDeadline = settings.imageDeadline
+    gw.hedgePercentile = settings.hedgePercentile
+    gw.hedgeBudget = latency.HedgeBudget(settings.hedgeBudgetPerHour)
  
     # create the main window
     labelForImageDisplay, labelQRForImage = create_main_window(settings.isUsingHardwareButtons)
@@ -1589,8 +2567,57 @@ def main():
     labelForStatusDisplay = create_status_window()
     display_text_in_status_window() # hide the status window
 
-    # capture a second of audio to initialize driver on RPi
-    recordAudioFromMicrophone(.25)
+    # one OpenAI client for every call, so connections are reused
+    client = openai_client.create_client()
+
+    # speech to text, a local model is loaded here so the first press doesn't wait for it
+    gw.sttBackend = speech_to_text.create_backend(settings.sttBackend, client, settings.sttModel, settings.transcribeWorkers)
+    if settings.sttCompare:
+        otherBackend = [name for name in speech_to_text.BACKENDS if name != settings.sttBackend][0]
+        gw.sttCompareBackend = speech_to_text.create_backend(otherBackend, client, workers=settings.transcribeWorkers)
+
+    if settings.useTranscriptCache:
+        # a recording from a file is the one that is replayed, so -w keeps transcripts on disk; live audio 
+        # never repeats, so it is only kept in memory and a press doesn't write to the SD card.
+        # On disk keep up to 20 MB of transcripts for 90 days
+        isOnDisk = settings.transcriptCacheOnDisk or settings.nextProcessStep == processStep.UseAudioFile
+        diskTier = (s2p_cache.DiskCache("cache/transcripts.sqlite", 20*1024*1024, 90*24*3600)
+                    if isOnDisk else None)
+        gw.transcriptCache = s2p_cache.MemoCache(100, diskTier)
+
+    if settings.abstractCacheSize > 0:
+        # abstracts are short, 5 MB on disk is many thousands of them
+        diskTier = s2p_cache.DiskCache("cache/abstracts.sqlite", 5*1024*1024) if settings.abstractCacheOnDisk else None
+        gw.abstractCache = s2p_cache.MemoCache(settings.abstractCacheSize, diskTier)
+
+    if os.path.exists(settings.promptScreenFile):
+        gw.promptScreen = prompt_screen.PromptScreen(settings.promptScreenFile)
+        logger.info("Prompt screen loaded with %d terms", len(gw.promptScreen))
+
+    if settings.useFallbackImage:
+        startTime = time.time()
+        gw.fallbackIndex = fallback_index.FallbackIndex("cache/captions.jsonl")
+        # pictures approved before the index was kept, or made without it, are found from their saved text
+        seeded = seedFallbackIndex()
+        logger.info("Loaded %d captions for fallback images (%d new from history) in %.2f s", 
+                    len(gw.fallbackIndex), seeded, time.time() - startTime)
+
+    if settings.imageCacheHours > 0:
+        # entries point at pictures in history/, evicting one doesn't delete the picture
+        gw.imageCache = s2p_cache.DiskCache("cache/images.sqlite", 
+                                            int(settings.imageCacheMB*1024*1024), settings.imageCacheHours*3600)
+
+    if settings.useLedPWM:
+        changeBlinkRate(LED_USE_PWM)
+
+    # open the microphone now so a button press doesn't wait for the audio driver
+    openAudioDevice(settings.prerollSeconds)
+
+    # pictures are made on their own thread while this one keeps the windows up to date
+    gw.pipelineExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline")
+    gw.isInputReady = tk.BooleanVar(value=False)
+    root.tk.createfilehandler(uiWakeRead, tk.READABLE, drainUIQueue)
+    drainUIQueue()
 
     # ----------------------
     # Main Loop 
@@ -1603,7 +2630,28 @@ def main():
 
     lastCommandTime = 0
 
+    def rotateIdleImage():
+        # show the idle images after 90 seconds without a command, checked every IDLE_CHECK_MS
+        nonlocal randomDisplayMode, lastCommandTime
+        if (time.time() - lastCommandTime > 90):
+            lastCommandTime = time.time()
+            randomDisplayMode = True 
+
+        if randomDisplayMode and not gw.isPipelineBusy:
+            display_random_history_image(labelForImageDisplay, labelQRForImage)
+
+        if not gw.isQuitting:
+            root.after(IDLE_CHECK_MS, rotateIdleImage)
+
+    if settings.idleCacheMB > 0:
+        gw.idleRotation = idle_rotation.IdleRotation("idleDisplayFiles", int(settings.idleCacheMB*1024*1024), gw.useS3)
+
     display_random_history_image(labelForImageDisplay, labelQRForImage)
+    root.after(IDLE_CHECK_MS, rotateIdleImage)
+
+    if not settings.isUsingHardwareButtons:
+        # typed commands arrive through the Tk event loop, no polling
+        root.tk.createfilehandler(sys.stdin, tk.READABLE, readCommandFromStdin)
 
     while not gw.isQuitting:
 
@@ -1632,53 +2680,46 @@ def main():
                 inputCommand = ''
                 while inputCommand == '' and not gw.isQuitting:
                     
-                    if select.select([sys.stdin], [], [], 0)[0]:
-                        while sys.stdin in select.select([sys.stdin], [], [], 0)[0]:
-                            inputCommand += sys.stdin.read(1)
-                        # remove whitespace
-                        inputCommand = inputCommand.strip()
-
-                        randomDisplayMode = False  # we have command input
-                        print("Command input: " + inputCommand)
-                        if inputCommand == 'h':
-                            # not in the menu except on RPi
-                            # don't ask the user for input again, rely on hardware buttons
-                            settings.isUsingHardwareButtons = True
-                            print("\r\nHardware control enabled")
-
-                        elif inputCommand == 'q': # quit
-                            gw.isQuitting = True
-                            settings.numLoops = 0
-                            settings.autoLoopDelay = 0
-
-                        elif inputCommand == 'a': # auto mode
-                            settings.numLoops = LOOPS_MAX
-                            print("Will loop: " + str(settings.numLoops) + " times")
-
-                        elif inputCommand == 'o': # once
-                            lastCommandTime = time.time()
-                            settings.nextProcessStep = processStep.CaptureAudio
-                            settings.numLoops = 1
-                            settings.autoLoopDelay = 0
-
-                        elif inputCommand == 'x': # experimental for testing out new features
-                            lastCommandTime = time.time()
-                            voice_command_functions["show status"](labelForStatusDisplay)
-                            executeImageGeneration = False
-                            
-                        else: # default is no action
-                            print("No action input " + inputCommand)
-                            inputCommand = ''
-
-                    # if the last command was more than 90 seconds ago
-                    if (time.time() - lastCommandTime > 90):
+                    inputKind, inputCommand, inputTime = waitForInput()
+                    if inputKind != "command":
+                        # the button is only used under hardware control, so a press made while busy isn't waiting any more
+                        if inputKind == "button":
+                            gw.queuedPresses = max(0, gw.queuedPresses - 1)
+                        inputCommand = ''
+                        continue
+
+                    randomDisplayMode = False  # we have command input
+                    print("Command input: " + inputCommand)
+                    if inputCommand == 'h':
+                        # not in the menu except on RPi
+                        # don't ask the user for input again, rely on hardware buttons
+                        settings.isUsingHardwareButtons = True
+                        root.tk.deletefilehandler(sys.stdin)
+                        print("\r\nHardware control enabled")
+
+                    elif inputCommand == 'q': # quit
+                        gw.isQuitting = True
+                        settings.numLoops = 0
+                        settings.autoLoopDelay = 0
+
+                    elif inputCommand == 'a': # auto mode
+                        settings.numLoops = LOOPS_MAX
+                        print("Will loop: " + str(settings.numLoops) + " times")
+
+                    elif inputCommand == 'o': # once
                         lastCommandTime = time.time()
-                        randomDisplayMode = True 
-
-                    if randomDisplayMode:
-                        display_random_history_image(labelForImageDisplay, labelQRForImage)
+                        settings.nextProcessStep = processStep.CaptureAudio
+                        settings.numLoops = 1
+                        settings.autoLoopDelay = 0
 
-                    update_main_window()
+                    elif inputCommand == 'x': # experimental for testing out new features
+                        lastCommandTime = time.time()
+                        voice_command_functions["show status"](labelForStatusDisplay)
+                        executeImageGeneration = False
+                        
+                    else: # default is no action
+                        print("No action input " + inputCommand)
+                        inputCommand = ''
 
 
             # we can't use else from the if above because the command menu input might set this value
@@ -1686,27 +2727,22 @@ def main():
                 # we're not going to prompt the user for input, rely on hardware buttons
                 isButtonPressed = False
 
-                while not isButtonPressed:
-                    # running on RPi
-                    update_main_window()
-                    # read gpio pin, if pressed, then do a cycle of keyword input
-                    if GPIO.input(BUTTON_GO) == BUTTON_PRESSED:
+                while not isButtonPressed and not gw.isQuitting:
+                    # sleeps in the Tk event loop until the button interrupt or a window event
+                    inputKind, inputValue, inputTime = waitForInput()
+                    if inputKind == "button":
                         settings.isAudioKeywords = True
                         settings.numLoops = 1
                         isButtonPressed = True
                         lastCommandTime = time.time()
                         randomDisplayMode = False
+                        gw.lastPressTime = inputTime
+                        gw.queuedPresses = max(0, gw.queuedPresses - 1)
                         logToFile.info("Button pressed")
                         settings.nextProcessStep = processStep.CaptureAudio
 
-                    else:
-                        # if the last command was more than 90 seconds ago, then display history
-                        if (time.time() - lastCommandTime > 90):
-                            lastCommandTime = time.time()
-                            randomDisplayMode = True 
-                            
-                    if randomDisplayMode:
-                        display_random_history_image(labelForImageDisplay, labelQRForImage)
+                if gw.isQuitting:
+                    executeImageGeneration = False
 
 
         if settings.isAudioKeywords: 
@@ -1718,14 +2754,19 @@ def main():
 
             # loop through a number of picture generation cycles
             for i in range(0, settings.numLoops, 1):
+                # the pauses below run the Tk event loop, so keep rotateIdleImage from covering the new picture
+                randomDisplayMode = False
+                lastCommandTime = time.time()
+
                 # this is where all the work happens
                 # collect audio, transcribe, summarize, extract keywords, generate images, display images
-                audioToPicture(settings, labelForImageDisplay, labelForMessageDisplay, labelForStatusDisplay, filePrefix, labelQRForImage)  # XXX
+                runAudioToPicture(settings, labelForImageDisplay, labelForMessageDisplay, labelForStatusDisplay, filePrefix, labelQRForImage)  # XXX
+                lastCommandTime = time.time()
 
                 if not settings.isUsingHardwareButtons and settings.numLoops > 1: 
                     # delay before the next for loop iteration, we don't do this when using hardware buttons
                     print("delaying " + str(settings.autoLoopDelay) + " seconds...")
-                    time.sleep(settings.autoLoopDelay)            
+                    waitKeepingWindowsServiced(settings.autoLoopDelay)
 
         # let the tkinter window events happen
         update_main_window()
@@ -1734,13 +2775,18 @@ def main():
                                         processStep.UseSummaryFile, processStep.UseKeywordsFile, 
                                         processStep.UseImageFile}:
             # we're done with the command line file argument
-            gw.isQuitting = True 
             print("Done with command line file argument. Pause for 15 seconds.")
-            time.sleep(15)
+            waitKeepingWindowsServiced(15)
+            gw.isQuitting = True 
         
         # end of loop
 
     # all done
+    gw.pipelineExecutor.shutdown()
+    if gw.idleRotation is not None:
+        gw.idleRotation.close()
+    closeAudioDevice()
+
     if not g_isMacOS:
         # running on RPi
         # Stop the LED thread
@@ -0,0 +1,185 @@
+"""
+Persistent caches for speech2picture.
+
+DiskCache is a small key/value store kept in an SQLite file. Entries older than
+max_age seconds are dropped, and when the total size of the entries goes over
+max_bytes the least recently used ones are dropped until it fits again. It is
+safe to use from several threads.
+
+A value can also stand for a file kept elsewhere, with the file's size given to
+put(); evicting the entry then only forgets the file, it does not delete it.
+
+MemoCache remembers results in memory, dropping the least recently used when it
+is full, optionally backed by a DiskCache so results survive a restart.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalise_text(text):
+    '''lower case, punctuation removed and whitespace collapsed, so trivially different text matches'''
+    return " ".join(re.sub(r"[^\w\s']", " ", text.lower()).split())
+
+
+def hash_bytes(data):
+    '''hex SHA-256 of data'''
+    return hashlib.sha256(data).hexdigest()
+
+
+class DiskCache:
+    """
+    Key/value store in an SQLite file with size and age based eviction.
+
+    :param path: the SQLite file, created if need be
+    :param max_bytes: most total entry size kept
+    :param max_age: seconds an entry is kept, None for no limit
+    """
+
+    def __init__(self, path, max_bytes, max_age=None):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS cache (
+                                key TEXT PRIMARY KEY,
+                                value TEXT NOT NULL,
+                                size INTEGER NOT NULL,
+                                created REAL NOT NULL,
+                                accessed REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        self._db.commit()
+        self.evict()
+
+    def get(self, key):
+        '''return the value stored for key, or None'''
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, created FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.max_age is not None and now - row[1] > self.max_age:
+                self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._db.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, value, size=None):
+        """
+        Store value for key.
+
+        :param size: the size counted against max_bytes, the length of value by default
+        """
+        if size is None:
+            size = len(value.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO cache (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                             (key, value, size, now, now))
+            self._db.commit()
+        self.evict()
+
+    def delete(self, key):
+        with self._lock:
+            self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._db.commit()
+
+    def evict(self):
+        '''drop entries that are too old, then the least recently used until the total size fits'''
+        with self._lock:
+            if self.max_age is not None:
+                self._db.execute("DELETE FROM cache WHERE created < ?", (time.time() - self.max_age,))
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+            if total > self.max_bytes:
+                dropped = []
+                for key, size in self._db.execute("SELECT key, size FROM cache ORDER BY accessed"):
+                    if total <= self.max_bytes:
+                        break
+                    dropped.append((key,))
+                    total -= size
+                self._db.executemany("DELETE FROM cache WHERE key = ?", dropped)
+            self._db.commit()
+
+    def stats(self):
+        '''short text description of the cache'''
+        with self._lock:
+            count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+        return "%d entries, %d KB, %d hits, %d misses" % (count, total // 1024, self.hits, self.misses)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class MemoCache:
+    """
+    Least recently used in-memory cache with an optional DiskCache behind it.
+
+    :param max_entries: most entries kept in memory
+    :param disk: optional DiskCache, looked in when memory misses and written through on put()
+    """
+
+    def __init__(self, max_entries, disk=None):
+        self.max_entries = max_entries
+        self.disk = disk
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''return the value stored for key, or None'''
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        value = self.disk.get(key) if self.disk is not None else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._remember(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def _remember(self, key, value):
+        # called with the lock held
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        '''short text description of the cache'''
+        with self._lock:
+            msg = "%d entries, %d hits, %d from disk, %d misses" % (
+                len(self._entries), self.hits, self.disk_hits, self.misses)
+        return msg
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
@@ -0,0 +1,165 @@
+"""
+Speech to text for speech2picture.
+
+A SpeechToTextBackend turns a file-like audio object into English text. There are
+two: OpenAIBackend sends the audio to the OpenAI Whisper API, LocalWhisperBackend
+runs a Whisper model on the CPU with faster-whisper, so no network is needed.
+create_backend() builds one by name.
+
+Long recordings are cut into overlapping segments (see
+audio_conditioning.split_at_silence), transcribed at the same time on a small
+thread pool, and the pieces stitched back into one transcript with the words
+heard twice in the overlaps removed.
+"""
+
+import abc
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import keyword_extract
+import openai_client
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ["openai", "local"]
+
+MAX_OVERLAP_WORDS = 12      # longest run of repeated words looked for at a segment boundary
+BOUNDARY_SLACK_WORDS = 2    # words at the start of a segment that may be a cut-off partial word
+MIN_SINGLE_WORD_OVERLAP = 4 # letters a word needs to count as an overlap on its own
+
+
+class SpeechToTextBackend(abc.ABC):
+    '''turns audio into English text'''
+
+    name = ""
+
+    def __init__(self, model):
+        self.model = model
+
+    @abc.abstractmethod
+    def transcribe(self, audioFile):
+        """
+        Transcribe, translating into English if need be.
+
+        :param audioFile: file-like object with a name attribute giving the audio format
+        :return: the transcript text
+        """
+
+
+class OpenAIBackend(SpeechToTextBackend):
+    '''the OpenAI Whisper API'''
+
+    name = "openai"
+
+    def __init__(self, client, model="whisper-1"):
+        super().__init__(model)
+        self.client = openai_client.for_endpoint(client, "transcribe")
+
+    def transcribe(self, audioFile):
+        def translate():
+            # a retry has to send the file from the start again
+            audioFile.seek(0)
+            # used to use transcription.create, but the text comes back in the language spoken
+            return self.client.audio.translations.create(
+                model=self.model,
+                file=audioFile)
+
+        response = openai_client.call_with_retries("transcribe", translate)
+        logger.debug("Transcript object: " + str(response))
+        return response.text
+
+
+class LocalWhisperBackend(SpeechToTextBackend):
+    """
+    Whisper on the CPU using faster-whisper (pip install faster-whisper).
+
+    The model is loaded once, when the backend is created. tiny and base run at a
+    usable speed on a Raspberry Pi 4.
+
+    :param workers: transcriptions that may run at the same time from different threads
+    """
+
+    name = "local"
+
+    def __init__(self, model="base", workers=1):
+        super().__init__(model)
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError:
+            raise RuntimeError("the local speech to text backend needs faster-whisper: pip install faster-whisper")
+        self._model = WhisperModel(model, device="cpu", compute_type="int8", num_workers=workers)
+
+    def transcribe(self, audioFile):
+        segments, info = self._model.transcribe(audioFile, task="translate", beam_size=1)
+        logger.debug("Detected language %s with probability %.2f", info.language, info.language_probability)
+        return " ".join(segment.text.strip() for segment in segments)
+
+
+def create_backend(name, client=None, model=None, workers=1):
+    """
+    Build a speech to text backend by name.
+
+    :param name: "openai" or "local"
+    :param client: OpenAI client, needed for "openai"
+    :param model: model name, None for the backend's default
+    :param workers: transcriptions that may run at the same time
+    """
+    if name == "openai":
+        return OpenAIBackend(client, model or "whisper-1")
+    if name == "local":
+        return LocalWhisperBackend(model or "base", workers)
+    raise ValueError("unknown speech to text backend: " + str(name))
+
+
+def transcribe_segments(segments, transcribe, max_workers=4):
+    """
+    Transcribe segments concurrently and return the texts in segment order.
+
+    :param segments: list of file-like audio objects
+    :param transcribe: function taking one segment and returning its text
+    :param max_workers: most transcriptions in flight at once
+    """
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="transcribe") as executor:
+        return list(executor.map(transcribe, segments))
+
+
+def _normalise(word):
+    return re.sub(r"[^\w']", "", word.lower())
+
+
+def stitch_transcripts(texts):
+    """
+    Join the transcripts of overlapping segments into one transcript.
+
+    Where the end of one segment is repeated at the start of the next, the repeat
+    is dropped. The first couple of words of a segment may be a word the cut
+    split in half, so the match may start a little way in.
+    """
+    words = []
+    for text in texts:
+        nextWords = text.split()
+        if words and nextWords:
+            words.extend(nextWords[_overlap_length(words, nextWords):])
+        else:
+            words.extend(nextWords)
+    return " ".join(words)
+
+
+def _overlap_length(previous, following):
+    '''number of words at the start of following that repeat the end of previous'''
+    prevNorm = [_normalise(w) for w in previous[-MAX_OVERLAP_WORDS:]]
+    nextNorm = [_normalise(w) for w in following[:MAX_OVERLAP_WORDS + BOUNDARY_SLACK_WORDS]]
+
+    # longest match wins; a single word only counts if it is too long and uncommon to be a coincidence
+    for length in range(min(len(prevNorm), len(nextNorm)), 0, -1):
+        for skip in range(0, BOUNDARY_SLACK_WORDS + 1):
+            if nextNorm[skip:skip + length] == prevNorm[-length:]:
+                if length == 1 and not _is_distinctive(prevNorm[-1]):
+                    continue
+                return skip + length
+    return 0
+
+
+def _is_distinctive(word):
+    return len(word) >= MIN_SINGLE_WORD_OVERLAP and word not in keyword_extract.STOPWORDS